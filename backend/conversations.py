@@ -0,0 +1,119 @@
+"""Inbox rows kept up to date as messages are sent.
+
+``db.conversations`` holds one document per participant of each (listing,
+counterpart) thread: the last message and how many messages that participant
+hasn't read yet. The inbox is then a single indexed page of that collection,
+however many messages a user has exchanged.
+"""
+import logging
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_id(listing_id: str, counterpart_id: str) -> str:
+    """Id of a thread as seen by one participant (unique per user_id)"""
+    return f"{listing_id}:{counterpart_id}"
+
+
+def _upsert(user_id: str, counterpart_id: str, message: dict, unread: int) -> UpdateOne:
+    listing_id = message["listing_id"]
+    update = {
+        "$set": {"last_message": message},
+        "$max": {"last_message_at": message["created_at"]},
+        "$setOnInsert": {"id": conversation_id(listing_id, counterpart_id)},
+    }
+    if unread:
+        update["$inc"] = {"unread": unread}
+    else:
+        update["$setOnInsert"]["unread"] = 0
+    return UpdateOne(
+        {"user_id": user_id, "listing_id": listing_id, "counterpart_id": counterpart_id},
+        update,
+        upsert=True,
+    )
+
+
+async def record_message(db, message: dict) -> None:
+    """Update both participants' inbox rows for a newly sent message"""
+    sender, recipient = message["from_user_id"], message["to_user_id"]
+    requests = [_upsert(sender, recipient, message, unread=0)]
+    if recipient != sender:
+        requests.append(_upsert(recipient, sender, message, unread=1))
+    await db.conversations.bulk_write(requests, ordered=False)
+
+
+async def mark_read(db, user_id: str, listing_id: str, counterpart_id: str) -> int:
+    """Mark a thread's incoming messages as read; returns how many changed"""
+    result = await db.messages.update_many(
+        {"listing_id": listing_id, "from_user_id": counterpart_id, "to_user_id": user_id, "read": False},
+        {"$set": {"read": True}},
+    )
+    await db.conversations.update_one(
+        {"user_id": user_id, "listing_id": listing_id, "counterpart_id": counterpart_id},
+        {"$set": {"unread": 0}},
+    )
+    return result.modified_count
+
+
+BACKFILL_ID = "backfill_conversations"
+
+
+async def backfill_conversations(db, batch_size: int = 1000) -> int:
+    """Build inbox rows from existing messages, once.
+
+    Rows are only ever inserted, never overwritten, so a run interrupted by a
+    crash (or racing new messages) is simply repeated on the next start until
+    it completes and records its marker in ``db.migrations``.
+    """
+    if await db.migrations.find_one({"_id": BACKFILL_ID}):
+        return 0
+
+    # One group per thread: the two participants, in a fixed order
+    first = {"$cond": [{"$lte": ["$from_user_id", "$to_user_id"]}, "$from_user_id", "$to_user_id"]}
+    second = {"$cond": [{"$lte": ["$from_user_id", "$to_user_id"]}, "$to_user_id", "$from_user_id"]}
+    pipeline = [
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"listing_id": "$listing_id", "first": first, "second": second},
+            "last_message": {"$last": "$$ROOT"},
+            "unread_first": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$to_user_id", first]}, {"$ne": ["$read", True]}]}, 1, 0
+            ]}},
+            "unread_second": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$to_user_id", second]}, {"$ne": ["$read", True]}]}, 1, 0
+            ]}},
+        }},
+    ]
+    requests = []
+    written = 0
+    async for row in db.messages.aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        message = {k: v for k, v in row["last_message"].items() if k != "_id"}
+        sides = [(key["first"], key["second"], row["unread_first"])]
+        if key["second"] != key["first"]:
+            sides.append((key["second"], key["first"], row["unread_second"]))
+        for user_id, counterpart_id, unread in sides:
+            requests.append(UpdateOne(
+                {"user_id": user_id, "listing_id": key["listing_id"], "counterpart_id": counterpart_id},
+                {"$setOnInsert": {
+                    "id": conversation_id(key["listing_id"], counterpart_id),
+                    "last_message": message,
+                    "last_message_at": message["created_at"],
+                    "unread": unread,
+                }},
+                upsert=True,
+            ))
+        if len(requests) >= batch_size:
+            written += (await db.conversations.bulk_write(requests, ordered=False)).upserted_count
+            requests = []
+    if requests:
+        written += (await db.conversations.bulk_write(requests, ordered=False)).upserted_count
+    await db.migrations.update_one(
+        {"_id": BACKFILL_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    if written:
+        logger.info(f"Backfilled {written} conversation rows from messages")
+    return written
@@ -0,0 +1,160 @@
+"""Precomputed listing and user counts.
+
+``db.counters`` holds one document per (status, category, gender) shape of
+listing with how many listings have it, plus one for the number of users.
+Every write path that creates, deletes or reshapes a listing passes the
+before/after documents to ``ListingCounters``, which ``$inc``s the affected
+shapes, so /api/stats and the pagination count read a handful of small
+documents instead of counting the collections.
+
+Increments can drift from the truth (a crash between the write and the
+``$inc``, a write made outside the API), so the counters are checked against
+a ``$group`` over the real collections at startup and every ``interval``
+seconds, and set to the counted value only if no other write touched them
+in between.
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+SHAPE = ("status", "category", "gender")
+USERS_ID = "users"
+
+
+def shape_of(listing: dict) -> tuple:
+    return tuple(listing.get(field) for field in SHAPE)
+
+
+def counter_id(shape: tuple) -> str:
+    return "listings:" + ":".join("" if value is None else str(value) for value in shape)
+
+
+def _inc(shape: tuple, delta: int) -> UpdateOne:
+    return UpdateOne(
+        {"_id": counter_id(shape)},
+        {"$inc": {"count": delta}, "$setOnInsert": {"kind": "listings", **dict(zip(SHAPE, shape))}},
+        upsert=True,
+    )
+
+
+class ListingCounters:
+    def __init__(self, interval: float = 3600.0):
+        self.interval = interval
+        self._task = None
+        self.reconciles = 0
+        self.corrected = 0
+
+    async def listings_changed(self, db, before: list = (), after: list = ()) -> None:
+        """Move counts from the shapes of ``before`` to those of ``after``"""
+        deltas = Counter()
+        for listing in before:
+            deltas[shape_of(listing)] -= 1
+        for listing in after:
+            deltas[shape_of(listing)] += 1
+        requests = [_inc(shape, delta) for shape, delta in deltas.items() if delta]
+        if not requests:
+            return
+        try:
+            await db.counters.bulk_write(requests, ordered=False)
+        except PyMongoError as e:
+            # The next reconcile repairs whatever this missed
+            logger.error(f"Listing counter update failed: {e}")
+
+    async def listing_changed(self, db, before: dict = None, after: dict = None) -> None:
+        await self.listings_changed(db, [before] if before else [], [after] if after else [])
+
+    async def users_changed(self, db, delta: int) -> None:
+        try:
+            await db.counters.update_one(
+                {"_id": USERS_ID}, {"$inc": {"count": delta}, "$setOnInsert": {"kind": "users"}}, upsert=True
+            )
+        except PyMongoError as e:
+            logger.error(f"User counter update failed: {e}")
+
+    async def count_listings(self, db, status: str, category: str = None, gender: str = None) -> int:
+        query = {"kind": "listings", "status": status}
+        if category:
+            query["category"] = category
+        if gender:
+            query["gender"] = gender
+        rows = await db.counters.find(query, {"count": 1}).to_list(None)
+        return max(sum(row["count"] for row in rows), 0)
+
+    async def count_users(self, db) -> int:
+        row = await db.counters.find_one({"_id": USERS_ID})
+        return max(row["count"], 0) if row else 0
+
+    async def reconcile(self, db) -> int:
+        """Correct the counters against the collections; returns how many were wrong.
+
+        Each correction is a compare-and-set against the count read before
+        the collections were counted: a counter that moved in the meantime
+        (a write's ``$inc``, another node reconciling) is left for the next
+        pass rather than overwritten or corrected twice.
+        """
+        stored = {row["_id"]: row["count"] async for row in db.counters.find({}, {"count": 1})}
+
+        pipeline = [{"$group": {"_id": {field: f"${field}" for field in SHAPE}, "count": {"$sum": 1}}}]
+        actual = {}
+        shapes = {}
+        async for row in db.listings.aggregate(pipeline):
+            # A null and a missing field group apart but share a counter
+            _id = counter_id(tuple(row["_id"].get(field) for field in SHAPE))
+            actual[_id] = actual.get(_id, 0) + row["count"]
+            shapes[_id] = {field: row["_id"].get(field) for field in SHAPE}
+        actual[USERS_ID] = await db.users.count_documents({})
+
+        requests = []
+        for _id in actual.keys() | stored.keys():
+            count = actual.get(_id, 0)
+            if _id not in stored:
+                kind = {"kind": "users"} if _id == USERS_ID else {"kind": "listings", **shapes[_id]}
+                # Unless a write has created it since
+                requests.append(UpdateOne({"_id": _id}, {"$setOnInsert": {"count": count, **kind}}, upsert=True))
+            elif stored[_id] != count:
+                requests.append(UpdateOne({"_id": _id, "count": stored[_id]}, {"$set": {"count": count}}))
+        corrected = 0
+        if requests:
+            result = await db.counters.bulk_write(requests, ordered=False)
+            corrected = result.modified_count + result.upserted_count
+            logger.info(f"Reconciled {corrected} of {len(requests)} wrong counters")
+        # Shapes no listing has any more
+        stale = [_id for _id in stored if _id not in actual]
+        if stale:
+            await db.counters.delete_many({"_id": {"$in": stale}, "count": 0})
+        self.reconciles += 1
+        self.corrected += corrected
+        return corrected
+
+    async def _run(self, db) -> None:
+        while True:
+            try:
+                await self.reconcile(db)
+            except PyMongoError as e:
+                logger.error(f"Counter reconcile failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, db) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "reconciles": self.reconciles,
+            "corrected": self.corrected,
+        }
@@ -0,0 +1,146 @@
+"""MongoDB index registry.
+
+Every query shape issued by server.py should be served by one of the indexes
+declared here. ``ensure_indexes`` creates them at startup and ``index_report``
+compares the registry with what the database actually has.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        # get_current_user runs this lookup on every authenticated request
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "listings": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # get_listings / get_listings_count / get_admin_listings; the trailing
+        # id matches the (created_at, id) keyset used by cursor pagination
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("category", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([
+            ("status", ASCENDING), ("category", ASCENDING), ("gender", ASCENDING),
+            ("created_at", DESCENDING), ("id", DESCENDING),
+        ]),
+        IndexModel([("status", ASCENDING), ("featured", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        # Location filter: anchored prefix match on the materialized path
+        IndexModel([("status", ASCENDING), ("location_path", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        # get_listings ?search= ; status is an equality prefix so a search only
+        # walks the posting lists of one status partition
+        IndexModel(
+            [
+                ("status", ASCENDING),
+                ("title", TEXT), ("description", TEXT),
+                ("location.city", TEXT), ("location.district", TEXT),
+                ("location.region", TEXT), ("location.country", TEXT),
+            ],
+            name="listing_text",
+            weights={
+                "title": 10, "description": 1,
+                "location.city": 5, "location.district": 5,
+                "location.region": 3, "location.country": 2,
+            },
+            default_language="english",
+        ),
+        # get_my_listings, delete_user, update_user_status
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "favorites": [
+        IndexModel([("user_id", ASCENDING), ("listing_id", ASCENDING)], unique=True),
+    ],
+    "messages": [
+        # get_conversation: each $or branch walks one of these in (created_at, id)
+        # keyset order and the two are merged, so no page needs a blocking SORT
+        IndexModel([
+            ("listing_id", ASCENDING), ("from_user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING),
+        ]),
+        IndexModel([
+            ("listing_id", ASCENDING), ("to_user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING),
+        ]),
+        # get_messages, delete_user
+        IndexModel([("from_user_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("to_user_id", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "conversations": [
+        IndexModel([("user_id", ASCENDING), ("listing_id", ASCENDING), ("counterpart_id", ASCENDING)], unique=True),
+        # Inbox pages: newest thread first, keyset on (last_message_at, id)
+        IndexModel([("user_id", ASCENDING), ("last_message_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("counterpart_id", ASCENDING)]),
+    ],
+    "media_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # MediaProcessor.start resumes unfinished jobs
+        IndexModel([("status", ASCENDING)]),
+        # MediaProcessor.collect_orphans
+        IndexModel([("refs", ASCENDING), ("last_seen_at", ASCENDING)]),
+    ],
+}
+
+
+def _key(spec) -> tuple:
+    """Normalize an index key spec so declared and existing indexes compare equal"""
+    key = []
+    for field, direction in spec.items():
+        if direction == TEXT:
+            # The server stores all text fields of an index as _fts/_ftsx
+            if ("_fts", TEXT) not in key:
+                key += [("_fts", TEXT), ("_ftsx", 1)]
+            continue
+        # index_information() may report directions as floats (1.0) for
+        # indexes created from the mongo shell
+        if isinstance(direction, (int, float)):
+            direction = int(direction)
+        if (field, direction) not in key:
+            key.append((field, direction))
+    return tuple(key)
+
+
+async def ensure_indexes(db) -> None:
+    """Create every declared index, logging (not raising) on failure.
+
+    Indexes are created one at a time so that a single failure, e.g. a unique
+    index over existing duplicate data, doesn't prevent the others.
+    """
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except PyMongoError as e:
+                logger.error(f"Failed to create index {model.document['name']} on {collection}: {e}")
+
+
+async def index_report(db) -> dict:
+    """Report declared indexes that are missing and existing ones never used.
+
+    Usage counters come from ``$indexStats`` and are reset whenever mongod
+    restarts, so "unused" is only meaningful after the server has been up for
+    a while under real traffic.
+    """
+    report = {}
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        existing_keys = {_key(dict(info["key"])): name for name, info in existing.items()}
+        declared_keys = {_key(model.document["key"]): model.document["name"] for model in models}
+
+        usage = {}
+        try:
+            async for stat in db[collection].aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = stat["accesses"]["ops"]
+        except OperationFailure as e:
+            logger.warning(f"$indexStats unavailable for {collection}: {e}")
+
+        report[collection] = {
+            "missing": [name for key, name in declared_keys.items() if key not in existing_keys],
+            "unused": [name for name, ops in usage.items() if ops == 0 and name != "_id_"],
+            "undeclared": [
+                name for key, name in existing_keys.items()
+                if key not in declared_keys and name != "_id_"
+            ],
+        }
+    return report
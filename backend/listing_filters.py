@@ -0,0 +1,205 @@
+"""Listing grid filters and the Mongo queries they translate to.
+
+``ListingFilter.from_params`` turns request parameters into a canonical,
+hashable spec: blank strings are dropped and whitespace collapsed, so
+``?category=female`` and ``?category=%20female&race=`` are the same filter,
+share cache entries and compile once. ``compile_filter`` builds the query,
+sort and index hint for a spec and is memoized per location snapshot.
+
+``QueryPlans`` explains the first query of every filter shape (which fields
+are set, not their values) and keeps the index the planner chose, logging a
+warning for shapes that fall back to a collection scan.
+"""
+import asyncio
+import logging
+import re
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+NEWEST_FIRST = (("created_at", DESCENDING), ("id", DESCENDING))
+
+# Index key patterns from indexes.py, by the equality filters they serve
+_HINTS = {
+    ("category", "gender"): [("status", ASCENDING), ("category", ASCENDING), ("gender", ASCENDING), *NEWEST_FIRST],
+    ("category",): [("status", ASCENDING), ("category", ASCENDING), *NEWEST_FIRST],
+    ("featured",): [("status", ASCENDING), ("featured", ASCENDING), *NEWEST_FIRST],
+    (): [("status", ASCENDING), *NEWEST_FIRST],
+}
+
+
+def _clean(value):
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        return value or None
+    return value
+
+
+@dataclass(frozen=True)
+class ListingFilter:
+    status: str = "approved"
+    category: Optional[str] = None
+    gender: Optional[str] = None
+    race: Optional[str] = None
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    location: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    search: Optional[str] = None
+    featured: Optional[bool] = None
+
+    @classmethod
+    def from_params(cls, **params) -> "ListingFilter":
+        values = {name: _clean(value) for name, value in params.items()}
+        if values.get("search"):
+            # $text matching is case-insensitive anyway
+            values["search"] = values["search"].casefold()
+        if values.get("status") is None:
+            values.pop("status", None)
+        return cls(**values)
+
+    def set_fields(self) -> tuple:
+        return tuple(f.name for f in fields(self) if f.name != "status" and getattr(self, f.name) is not None)
+
+    def counter_only(self) -> bool:
+        """Whether the maintained status x category x gender counters can answer a count"""
+        return set(self.set_fields()) <= {"category", "gender"}
+
+
+@dataclass(frozen=True)
+class CompiledFilter:
+    """Query, sort and hint for a filter. Shared between requests: treat as read-only."""
+    query: dict
+    sort: tuple
+    hint: Optional[list]
+    shape: tuple
+
+    def command_options(self) -> dict:
+        """The hint as aggregate() and raw commands take it: an index document, not (key, direction) pairs"""
+        return {"hint": dict(self.hint)} if self.hint else {}
+
+
+def location_clauses(location: str, locations) -> list:
+    """$or branches matching listings in (or under) the named place"""
+    location_pattern = re.escape(location)
+    free_text = [
+        {"location.city": {"$regex": location_pattern, "$options": "i"}},
+        {"location.district": {"$regex": location_pattern, "$options": "i"}},
+        {"location.region": {"$regex": location_pattern, "$options": "i"}},
+        {"location.country": {"$regex": location_pattern, "$options": "i"}},
+    ]
+    prefixes = locations.path_prefixes(location)
+    if not prefixes:
+        return free_text
+    # Anchored, case-sensitive prefixes are served by the location_path index;
+    # listings whose location isn't in the hierarchy keep the substring match
+    return [
+        {"location_path": {"$regex": f"^{re.escape(prefix)}(/|$)"}} for prefix in prefixes
+    ] + [{"location_path": None, "$or": free_text}]
+
+
+@lru_cache(maxsize=1024)
+def compile_filter(spec: ListingFilter, locations) -> CompiledFilter:
+    """Translate a filter; ``locations`` is the current LocationSnapshot"""
+    query = {"status": spec.status}
+    shape = ["status", *spec.set_fields()]
+
+    if spec.category:
+        query["category"] = spec.category
+    if spec.gender:
+        query["gender"] = spec.gender
+    if spec.race:
+        query["race"] = spec.race
+    if spec.min_age is not None:
+        query.setdefault("age", {})["$gte"] = spec.min_age
+    if spec.max_age is not None:
+        query.setdefault("age", {})["$lte"] = spec.max_age
+    if spec.location:
+        query["$or"] = location_clauses(spec.location, locations)
+        # Resolved places and free text are planned differently
+        if "location_path" not in query["$or"][0]:
+            shape[shape.index("location")] = "location_text"
+    if spec.min_price is not None:
+        query.setdefault("price", {})["$gte"] = spec.min_price
+    if spec.max_price is not None:
+        query.setdefault("price", {})["$lte"] = spec.max_price
+    if spec.featured is not None:
+        query["featured"] = spec.featured
+
+    sort = NEWEST_FIRST
+    hint = None
+    if spec.search:
+        # Served by the listing_text index; best matches first, newest first among equals
+        query["$text"] = {"$search": spec.search}
+        sort = (("score", {"$meta": "textScore"}),) + NEWEST_FIRST
+    elif not spec.location:
+        # The most selective equality prefix we have an index for; a text
+        # search or the location $or is left to the planner
+        equality = tuple(name for name in ("category", "gender") if getattr(spec, name))
+        if not spec.category and spec.featured is not None:
+            equality = ("featured",)
+        hint = _HINTS.get(equality)
+    return CompiledFilter(query=query, sort=sort, hint=hint, shape=tuple(shape))
+
+
+def _plan_indexes(stage: dict) -> list:
+    """Access stages (IXSCAN index names, COLLSCAN, TEXT_MATCH) in a winning plan"""
+    found = []
+    if "indexName" in stage:
+        found.append(stage["indexName"])
+    elif stage.get("stage") in ("COLLSCAN", "TEXT_MATCH"):
+        found.append(stage["stage"])
+    for child in [stage.get("inputStage"), stage.get("queryPlan"), *stage.get("inputStages", [])]:
+        if child:
+            found.extend(_plan_indexes(child))
+    return found
+
+
+class QueryPlans:
+    def __init__(self):
+        self._plans = {}
+        self._tasks = set()
+
+    def observe(self, db, compiled: CompiledFilter) -> None:
+        """Count a query of this shape, explaining the shape the first time it's seen"""
+        plan = self._plans.get(compiled.shape)
+        if plan is not None:
+            plan["queries"] += 1
+            return
+        self._plans[compiled.shape] = {"queries": 1, "indexes": None, "collscan": None}
+        task = asyncio.create_task(self._explain(db, compiled))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _explain(self, db, compiled: CompiledFilter) -> None:
+        command = {
+            "find": "listings", "filter": compiled.query, "sort": dict(compiled.sort), "limit": 1,
+            **compiled.command_options(),
+        }
+        plan = self._plans[compiled.shape]
+        try:
+            explained = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        except PyMongoError as e:
+            plan["error"] = str(e)
+            return
+        indexes = _plan_indexes(explained["queryPlanner"]["winningPlan"])
+        plan["indexes"] = indexes
+        plan["collscan"] = "COLLSCAN" in indexes
+        if plan["collscan"]:
+            logger.warning(f"Listing filter shape {compiled.shape} runs a COLLSCAN")
+
+    def stats(self) -> dict:
+        info = compile_filter.cache_info()
+        return {
+            "compiled": {"hits": info.hits, "misses": info.misses, "size": info.currsize},
+            "shapes": [
+                {"shape": list(shape), **plan}
+                for shape, plan in sorted(self._plans.items())
+            ],
+        }
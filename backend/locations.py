@@ -0,0 +1,185 @@
+"""The location hierarchy served to the location pickers.
+
+``locations.json`` maps country -> region -> city -> [districts]. It is parsed
+once, pre-encoded with an ETag, and reloaded when the file's mtime changes.
+Every place name is also indexed by the start of each of its words, so
+autocomplete is a binary search over a sorted list rather than a tree walk.
+
+Listings store where they are as a materialized path of slugs, e.g.
+``"ethiopia/addis-ababa/bole/gelan"``, so filtering by any level is an
+anchored prefix match on one indexed field.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("country", "region", "city", "district")
+
+
+def normalize(text: str) -> str:
+    """Case- and accent-insensitive form used for matching"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", normalize(name)).strip("-")
+
+
+def location_path(names: list) -> str:
+    return "/".join(slugify(name) for name in names)
+
+
+class LocationSnapshot:
+    def __init__(self, data: dict):
+        self.data = data
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.keys, self.entries = self._build_index(data)
+        # Exact (normalized) name -> every place with that name
+        self.by_name = {}
+        for _, entry in self.entries:
+            paths = self.by_name.setdefault(normalize(entry["name"]), [])
+            if entry["path"] not in paths:
+                paths.append(entry["path"])
+
+    @staticmethod
+    def _build_index(data: dict) -> tuple:
+        places = []
+        for country, regions in data.items():
+            places.append([country])
+            for region, cities in regions.items():
+                places.append([country, region])
+                for city, districts in cities.items():
+                    places.append([country, region, city])
+                    places.extend([country, region, city, district] for district in districts)
+
+        index = []
+        entries = []
+        for path in places:
+            entry = {
+                "name": path[-1],
+                "level": LEVELS[len(path) - 1],
+                "path": path,
+                "label": ", ".join(reversed(path)),
+            }
+            entries.append(entry)
+            words = normalize(path[-1]).split()
+            # "Bole Airport" is found by "bole", "bole a..." and "airport"
+            for i in range(len(words)):
+                index.append((" ".join(words[i:]), len(path), len(entries) - 1))
+        index.sort()
+        return [key for key, _, _ in index], [(position, entries[position]) for _, _, position in index]
+
+    def autocomplete(self, query: str, limit: int = 10) -> list:
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        matches = []
+        seen = set()
+        start = bisect.bisect_left(self.keys, prefix)
+        for i in range(start, len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                break
+            position, entry = self.entries[i]
+            if position in seen:
+                continue
+            seen.add(position)
+            matches.append(entry)
+        # Broader places first (a city before its districts), then alphabetical
+        matches.sort(key=lambda e: (LEVELS.index(e["level"]), normalize(e["label"])))
+        return matches[:limit]
+
+    def resolve(self, location) -> tuple:
+        """Canonical form of a listing location and its path, or (location, None).
+
+        Accepts the picker's {"country", "region", "city", "district"} dict,
+        matching each level case-insensitively and stopping at the first one
+        that isn't in the hierarchy, or free text such as "Bole, Addis Ababa".
+        """
+        if isinstance(location, dict):
+            names = []
+            level = self.data
+            for key in LEVELS:
+                value = location.get(key)
+                if not value or level is None:
+                    break
+                options = level if isinstance(level, dict) else {name: None for name in level}
+                match = next((name for name in options if normalize(name) == normalize(str(value))), None)
+                if match is None:
+                    break
+                names.append(match)
+                level = options[match]
+            if not names:
+                return location, None
+            canonical = {**location, **dict(zip(LEVELS, names))}
+            return canonical, location_path(names)
+
+        if isinstance(location, str) and location.strip():
+            parts = [normalize(part) for part in location.split(",") if part.strip()]
+            # The first part that names a place whose path contains all the
+            # others; when a name repeats at several levels, the broadest wins
+            for part in parts:
+                for path in sorted(self.by_name.get(part, []), key=len):
+                    in_path = {normalize(name) for name in path}
+                    if all(other in in_path for other in parts):
+                        return location, location_path(path)
+        return location, None
+
+    def path_prefixes(self, text: str) -> list:
+        """Paths of every place a location filter could mean"""
+        if "/" in text:
+            # "Ethiopia/Addis Ababa" and "ethiopia/addis-ababa" are the same path
+            return [location_path([part for part in text.split("/") if part.strip()])]
+        return [location_path(path) for path in self.by_name.get(normalize(text), [])]
+
+
+class LocationStore:
+    def __init__(self, path: Path, check_interval: float = 5):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+
+    async def get(self) -> LocationSnapshot:
+        """Current snapshot, reloading first if the file changed"""
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.check_interval:
+            return self._snapshot
+        async with self._lock:
+            if self._snapshot is None or time.monotonic() - self._checked_at >= self.check_interval:
+                await self._reload_if_changed()
+        return self._snapshot
+
+    async def _reload_if_changed(self) -> None:
+        mtime = (await asyncio.to_thread(os.stat, self.path)).st_mtime_ns
+        self._checked_at = time.monotonic()
+        if mtime == self._mtime:
+            return
+        try:
+            self._snapshot = await asyncio.to_thread(self._load)
+        except (OSError, ValueError) as e:
+            # Keep serving the last good copy while the file is being edited
+            if self._snapshot is None:
+                raise
+            logger.error(f"Failed to reload {self.path}: {e}")
+            return
+        self._mtime = mtime
+        self.reloads += 1
+        logger.info(f"Loaded locations from {self.path}")
+
+    def _load(self) -> LocationSnapshot:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return LocationSnapshot(json.load(f))
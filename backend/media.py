@@ -0,0 +1,541 @@
+"""Media processing for uploads.
+
+CPU-heavy work (Pillow decode, watermark compose, JPEG encode) runs in a
+bounded process pool so it never blocks the uvicorn event loop, and videos
+are transcoded by ffmpeg subprocesses driven through asyncio.
+
+Uploads are content-addressed: each stored object is keyed by the SHA-256 of
+the uploaded bytes and has one document in ``db.media_jobs`` recording its
+processing status and how many listings reference it. The bytes themselves
+live in a ``storage.Storage`` backend, with the bytes as uploaded kept under
+``originals/`` so processing always starts from them and a re-run produces
+the same output.
+
+A worker claims a job with a lease (``owner`` and ``lease_expires_at``) that
+it renews while processing. Jobs whose lease expired, because their worker
+died, are claimed by any worker at startup or on its next GC pass, so several
+API nodes can share the queue without processing a job twice at once.
+Objects no listing references are garbage-collected after a grace period.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+from pymongo import ReturnDocument, UpdateOne
+
+from storage import IMMUTABLE, REVALIDATE, Storage, content_type_for
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".webm"}
+
+WATERMARK_TEXT = "velvetroom"
+WATERMARK_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+
+class QueueFull(Exception):
+    """Raised when the media queue is at capacity; the client should retry later."""
+
+
+class TranscodeError(Exception):
+    """ffmpeg failed or timed out; the original upload is left untouched."""
+
+
+# ============ WORKER FUNCTIONS ============
+# These run inside the process pool, so they must stay importable top-level
+# functions that take and return plain picklable values.
+
+def plan_variants(stem: str, width: int, widths: list) -> list:
+    """Responsive sizes to derive from an image ``width`` pixels wide.
+
+    Never upscales: widths at or above the original are skipped, and an image
+    narrower than every configured width gets a single variant at its own
+    width so it still has a WebP rendition.
+    """
+    planned = sorted(w for w in widths if w < width) or [width]
+    return [
+        {"width": w, "webp": f"{stem}_{w}.webp", "jpeg": f"{stem}_{w}.jpg"}
+        for w in planned
+    ]
+
+
+def read_image_size(image_path) -> tuple:
+    """(width, height) from the image header, without decoding the pixels"""
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def watermark(img: Image.Image) -> Image.Image:
+    img = img.convert("RGBA")
+    width, height = img.size
+
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    # Scale font nicely
+    font_size = max(24, int(min(width, height) * 0.08))
+
+    try:
+        font = ImageFont.truetype(WATERMARK_FONT, font_size)
+    except Exception:
+        font = ImageFont.load_default()
+
+    # Pillow 10+ measurement
+    bbox = draw.textbbox((0, 0), WATERMARK_TEXT, font=font)
+    text_w = bbox[2] - bbox[0]
+    text_h = bbox[3] - bbox[1]
+
+    # Center position
+    x = (width - text_w) // 2
+    y = (height - text_h) // 2
+
+    # Semi-transparent background box (important for visibility)
+    padding = 20
+    draw.rectangle(
+        (x - padding, y - padding, x + text_w + padding, y + text_h + padding),
+        fill=(0, 0, 0, 120)
+    )
+
+    # Watermark text
+    draw.text((x, y), WATERMARK_TEXT, fill=(255, 255, 255, 200), font=font)
+
+    # Merge layers
+    return Image.alpha_composite(img, overlay).convert("RGB")
+
+
+def add_watermark_to_image(image_path: str, variants: list = ()) -> str:
+    """Watermark an image in place, then write its resized WebP/JPEG variants.
+
+    The watermark is applied once at full resolution and every variant is
+    downscaled from that, so all renditions carry the same mark.
+    """
+    watermarked = watermark(Image.open(image_path))
+
+    # Save optimized (fast + good quality); keep the original format so the
+    # upload URL stays valid
+    watermarked.save(image_path, quality=85, optimize=True)
+
+    directory = Path(image_path).parent
+    width, height = watermarked.size
+    for variant in variants:
+        size = (variant["width"], max(1, round(height * variant["width"] / width)))
+        resized = watermarked if size == watermarked.size else watermarked.resize(size, Image.LANCZOS)
+        resized.save(directory / variant["webp"], "WEBP", quality=80, method=4)
+        resized.save(directory / variant["jpeg"], "JPEG", quality=82, optimize=True, progressive=True)
+
+    return image_path
+
+
+# ============ VIDEO TRANSCODING ============
+
+async def add_watermark_to_video(video_path: Path, timeout: float) -> Path:
+    """Watermark a video with ffmpeg, replacing the original only on success"""
+    output_path = video_path.with_suffix(".wm.mp4")
+
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-i", str(video_path),
+        "-vf",
+        "drawtext=text='VelvetRoom':x=w-tw-20:y=h-th-20:"
+        "fontsize=24:fontcolor=white@0.7:box=1:boxcolor=black@0.4",
+        "-preset", "veryfast",
+        "-codec:a", "copy",
+        "-y",
+        str(output_path),
+    ]
+
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        proc.kill()
+        await proc.wait()
+        output_path.unlink(missing_ok=True)
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise TranscodeError(f"ffmpeg timed out after {timeout:.0f}s")
+
+    if proc.returncode != 0:
+        output_path.unlink(missing_ok=True)
+        tail = stderr.decode(errors="replace").strip().splitlines()[-1:] or [""]
+        raise TranscodeError(f"ffmpeg exited with {proc.returncode}: {tail[0]}")
+
+    os.replace(output_path, video_path)
+    return video_path
+
+
+# ============ JOB QUEUE ============
+
+def original_key(key: str) -> str:
+    """Where the unprocessed upload of ``key`` is kept; never served"""
+    return f"originals/{key}"
+
+
+class MediaProcessor:
+    """Bounded queue of media jobs: images go to a process pool, videos to ffmpeg."""
+
+    def __init__(
+        self,
+        storage: Storage,
+        max_workers: int = 2,
+        max_pending: int = 100,
+        video_workers: int = 1,
+        video_timeout: float = 600.0,
+        video_retries: int = 2,
+        gc_grace: float = 86400.0,
+        gc_interval: float = 3600.0,
+        lease: float = 300.0,
+        on_done=None,
+    ):
+        self.storage = storage
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.video_workers = video_workers
+        self.video_timeout = video_timeout
+        self.video_retries = video_retries
+        # Unreferenced files are only removed once nobody has uploaded or
+        # referenced them for gc_grace seconds, which covers uploads whose
+        # listing form hasn't been submitted yet
+        self.gc_grace = gc_grace
+        self.gc_interval = gc_interval
+        # Renewed every lease / 3 seconds while a job runs
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Awaited as on_done(db, job) after a job this worker ran is done
+        self.on_done = on_done
+        self._gc_task = None
+        self._executor = None
+        self._slots = None
+        self._video_slots = None
+        self._tasks = set()
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.collected = 0
+
+    @property
+    def pending(self) -> int:
+        """Jobs queued or running in this worker"""
+        return len(self._tasks)
+
+    async def start(self, db) -> None:
+        # spawn rather than fork: the parent holds motor's threads and sockets
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._video_slots = asyncio.Semaphore(self.video_workers)
+
+        await self.resume(db)
+        self._gc_task = asyncio.create_task(self._run_gc(db))
+
+    async def resume(self, db) -> int:
+        """Claim and restart unfinished jobs whose lease has expired"""
+        now = datetime.now(timezone.utc)
+        candidates = await db.media_jobs.find(
+            {"status": {"$in": ["queued", "processing"]}, **self._expired(now)}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        resumed = 0
+        for candidate in candidates:
+            job = await self._claim(db, candidate["id"])
+            if job is None:
+                # Another worker got there first
+                continue
+            self._spawn(db, job)
+            resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} media jobs")
+        return resumed
+
+    async def stop(self, db=None) -> None:
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            self._gc_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if db is not None:
+            # Let the next worker to start pick our jobs up without waiting out the lease
+            await db.media_jobs.update_many(
+                {"owner": self.owner, "status": {"$in": ["queued", "processing"]}},
+                {"$set": {"lease_expires_at": datetime.now(timezone.utc)}},
+            )
+
+    @staticmethod
+    def _expired(now: datetime) -> dict:
+        return {"lease_expires_at": {"$lt": now}}
+
+    async def _claim(self, db, job_id: str) -> dict:
+        """Take an unfinished job whose lease has expired; None if it isn't available"""
+        now = datetime.now(timezone.utc)
+        return await db.media_jobs.find_one_and_update(
+            {"id": job_id, "status": {"$in": ["queued", "processing"]}, **self._expired(now)},
+            {"$set": {"owner": self.owner, "lease_expires_at": now + timedelta(seconds=self.lease), "updated_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def submit(
+        self,
+        db,
+        job_id: str,
+        key: str,
+        kind: str,
+        source: Path,
+        user_id: str = None,
+        variants: list = None,
+    ) -> dict:
+        """Register an upload, store it under ``key`` and schedule its processing.
+
+        The job document is inserted before ``source`` is stored, so when two
+        identical uploads race only the one that wins the insert writes the
+        object; the other gets DuplicateKeyError. Uploads of a ``kind`` that
+        needs no processing are registered as done. Raises QueueFull when at
+        capacity.
+        """
+        if kind and self.pending >= self.max_pending:
+            raise QueueFull()
+
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "key": key,
+            "user_ids": [user_id] if user_id else [],
+            "status": "queued" if kind else "done",
+            "attempts": 0,
+            "variants": variants or [],
+            "error": None,
+            "refs": 0,
+            "created_at": now,
+            "updated_at": now,
+            "last_seen_at": now,
+            # Claimed by this worker from the start
+            "owner": self.owner if kind else None,
+            "lease_expires_at": now + timedelta(seconds=self.lease) if kind else None,
+        }
+        await db.media_jobs.insert_one(dict(job))
+        if kind:
+            await self._store_original(key, source)
+            self._spawn(db, job)
+        else:
+            await self.storage.put(key, source, content_type=content_type_for(key), cache_control=IMMUTABLE)
+        return job
+
+    async def _store_original(self, key: str, source: Path) -> None:
+        await self.storage.put(original_key(key), source, content_type=content_type_for(key))
+        # Served unprocessed until processing replaces it, so always revalidated
+        await self.storage.copy(original_key(key), key, content_type=content_type_for(key), cache_control=REVALIDATE)
+
+    async def retry(self, db, job_id: str, source: Path, user_id: str = None) -> dict:
+        """Re-run a failed job from a fresh copy of its bytes; None if it isn't failed"""
+        if self.pending >= self.max_pending:
+            raise QueueFull()
+
+        now = datetime.now(timezone.utc)
+        update = {"$set": {
+            "status": "queued", "error": None, "attempts": 0, "updated_at": now, "last_seen_at": now,
+            "owner": self.owner, "lease_expires_at": now + timedelta(seconds=self.lease),
+        }}
+        if user_id:
+            update["$addToSet"] = {"user_ids": user_id}
+        job = await db.media_jobs.find_one_and_update(
+            {"id": job_id, "status": "failed"},
+            update,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return None
+        await self._store_original(job["key"], source)
+        self._spawn(db, job)
+        return job
+
+    async def touch(self, db, job_id: str, user_id: str = None) -> dict:
+        """Record a duplicate upload of already stored bytes"""
+        self.deduplicated += 1
+        update = {"$set": {"last_seen_at": datetime.now(timezone.utc)}}
+        if user_id:
+            update["$addToSet"] = {"user_ids": user_id}
+        return await db.media_jobs.find_one_and_update(
+            {"id": job_id},
+            update,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    # ============ REFERENCES ============
+
+    async def update_refs(self, db, added: list = (), removed: list = ()) -> None:
+        """Apply reference count changes for listings gaining/losing uploads"""
+        counts = Counter(added)
+        counts.subtract(removed)
+        now = datetime.now(timezone.utc)
+        requests = [
+            UpdateOne({"id": job_id}, {"$inc": {"refs": delta}, "$set": {"last_seen_at": now}})
+            for job_id, delta in counts.items() if delta
+        ]
+        if requests:
+            await db.media_jobs.bulk_write(requests, ordered=False)
+
+    async def collect_orphans(self, db) -> int:
+        """Delete uploads no listing references and nobody touched within the grace period"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.gc_grace)
+        query = {
+            "refs": {"$lte": 0},
+            "status": {"$nin": ["queued", "processing"]},
+            "last_seen_at": {"$lt": cutoff},
+        }
+        collected = 0
+        async for job in db.media_jobs.find(query, {"_id": 0}):
+            # Re-check atomically: a new upload or listing may have claimed it
+            result = await db.media_jobs.delete_one({"id": job["id"], **query})
+            if not result.deleted_count:
+                continue
+            for variant in job.get("variants", []):
+                await self.storage.delete(variant["webp"])
+                await self.storage.delete(variant["jpeg"])
+            await self.storage.delete(job["key"])
+            await self.storage.delete(original_key(job["key"]))
+            collected += 1
+        self.collected += collected
+        return collected
+
+    async def _run_gc(self, db) -> None:
+        while True:
+            try:
+                collected = await self.collect_orphans(db)
+                if collected:
+                    logger.info(f"Garbage-collected {collected} unreferenced uploads")
+            except Exception as e:
+                logger.error(f"Media garbage collection failed: {e}")
+            try:
+                # Jobs left behind by workers that died since
+                await self.resume(db)
+            except Exception as e:
+                logger.error(f"Resuming media jobs failed: {e}")
+            await asyncio.sleep(self.gc_interval)
+
+    def _spawn(self, db, job: dict) -> None:
+        task = asyncio.create_task(self._run(db, job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, db, job: dict) -> None:
+        renewal = asyncio.create_task(self._renew_lease(db, job["id"]))
+        try:
+            if job["kind"] == "video":
+                await self._run_video(db, job)
+            else:
+                await self._run_image(db, job)
+        except asyncio.CancelledError:
+            # Left as "processing"; resumed once the lease expires
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Media job {job['id']} failed: {e}")
+            await self._set_status(db, job["id"], "failed", error=str(e), owner=None, lease_expires_at=None)
+            return
+        finally:
+            renewal.cancel()
+        self.completed += 1
+        if not await self._set_status(db, job["id"], "done", owner=None, lease_expires_at=None):
+            return
+        if self.on_done is not None:
+            try:
+                await self.on_done(db, job)
+            except Exception as e:
+                logger.error(f"Media job {job['id']} completion hook failed: {e}")
+
+    async def _renew_lease(self, db, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            now = datetime.now(timezone.utc)
+            result = await db.media_jobs.update_one(
+                {"id": job_id, "owner": self.owner},
+                {"$set": {"lease_expires_at": now + timedelta(seconds=self.lease)}},
+            )
+            if not result.matched_count:
+                # Reclaimed after a stall; harmless, as both runs start from the original
+                logger.warning(f"Media job {job_id} lease was taken over by another worker")
+                return
+
+    async def _run_image(self, db, job: dict) -> None:
+        variants = job.get("variants", [])
+        outputs = [name for variant in variants for name in (variant["webp"], variant["jpeg"])]
+        key = job["key"]
+        async with self._slots:
+            await self._set_status(db, job["id"], "processing")
+            async with self.storage.editing(key, outputs, source=original_key(key)) as path:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self._executor, add_watermark_to_image, str(path), variants)
+
+    async def _run_video(self, db, job: dict) -> None:
+        attempt = 0
+        while True:
+            attempt += 1
+            async with self._video_slots:
+                await self._set_status(db, job["id"], "processing", attempts=attempt)
+                try:
+                    key = job["key"]
+                    async with self.storage.editing(key, source=original_key(key)) as path:
+                        await add_watermark_to_video(path, self.video_timeout)
+                    return
+                except TranscodeError as e:
+                    if attempt > self.video_retries:
+                        raise
+                    logger.warning(f"Media job {job['id']} attempt {attempt} failed, retrying: {e}")
+            # Back off outside the slot so other videos can use it
+            await asyncio.sleep(2 ** attempt)
+
+    async def _set_status(self, db, job_id: str, status: str, error: str = None, **fields) -> bool:
+        # Only while we hold the job; a worker that took it over reports its own result
+        result = await db.media_jobs.update_one(
+            {"id": job_id, "owner": self.owner},
+            {"$set": {
+                "status": status,
+                "error": error,
+                "updated_at": datetime.now(timezone.utc),
+                **fields,
+            }}
+        )
+        return bool(result.matched_count)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "video_workers": self.video_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deduplicated": self.deduplicated,
+            "collected": self.collected,
+            "owner": self.owner,
+        }
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def default_video_workers() -> int:
+    # ffmpeg is itself multi-threaded; one encode per two cores keeps the API responsive
+    return max(1, (os.cpu_count() or 2) // 2)
@@ -0,0 +1,111 @@
+"""Serving uploaded media.
+
+Responses carry a strong ETag and, once an upload has finished processing,
+``Cache-Control: immutable``: upload names are never reused, so a finished
+file never changes. Single byte ranges are honored so video players can
+seek. With ``MEDIA_ACCEL`` set, Python only answers the headers and hands the
+byte copying to the front proxy via ``X-Accel-Redirect`` (nginx) or
+``X-Sendfile`` (Apache/lighttpd), which handle ranges themselves.
+"""
+import mimetypes
+import os
+import re
+
+import aiofiles
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def make_etag(stat) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def parse_range(header: str, size: int):
+    """(start, end) inclusive for a single satisfiable range, None to serve the whole file.
+
+    Raises ValueError for a well-formed but unsatisfiable range.
+    """
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        # Multi-range or malformed: ignoring Range is always allowed
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        # Invalid per RFC 9110, so the header is ignored rather than refused
+        return None
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(last))
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+async def _read_range(path, start: int, end: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(request: Request, path, cache_control: str) -> Response:
+    stat = os.stat(path)
+    etag = make_etag(stat)
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    accel = os.environ.get("MEDIA_ACCEL", "").lower()
+    if accel == "nginx":
+        prefix = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-uploads/")
+        headers["X-Accel-Redirect"] = f"{prefix}{path.name}"
+        return Response(headers=headers, media_type=media_type)
+    if accel == "sendfile":
+        headers["X-Sendfile"] = str(path)
+        return Response(headers=headers, media_type=media_type)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            if request.method == "HEAD":
+                return Response(status_code=206, headers=headers, media_type=media_type)
+            return StreamingResponse(
+                _read_range(path, start, end), status_code=206, headers=headers, media_type=media_type
+            )
+
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat, method=request.method)
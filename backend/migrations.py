@@ -0,0 +1,89 @@
+"""Online data migrations, run in the background at startup.
+
+Timestamps used to be written as ISO-8601 strings, which sort as text and
+had to be reparsed on every read. They are now stored as native BSON dates;
+``migrate_dates`` converts documents written before that change. Each update
+is conditional on the old value, so a document rewritten by the API while
+the migration runs is left alone, and finished collections cost one
+``$type`` query per field on later startups.
+
+``backfill_location_paths`` gives listings created before locations were
+normalized their ``location_path``.
+"""
+import logging
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = {
+    "users": ["created_at", "last_active", "vip_expiry"],
+    "listings": ["created_at"],
+    "favorites": ["created_at"],
+    "messages": ["created_at"],
+}
+
+
+def parse_date(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    # Naive strings were always written from UTC clocks
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_dates(db, batch_size: int = 1000) -> int:
+    """Convert string timestamps to dates; returns the number of fields converted"""
+    converted = 0
+    for collection, fields in DATE_FIELDS.items():
+        for field in fields:
+            requests = []
+            async for doc in db[collection].find({field: {"$type": "string"}}, {"_id": 1, field: 1}):
+                try:
+                    value = parse_date(doc[field])
+                except ValueError:
+                    logger.warning(f"Skipping unparseable {collection}.{field} on {doc['_id']}: {doc[field]!r}")
+                    continue
+                requests.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+                if len(requests) >= batch_size:
+                    converted += await _write(db, collection, requests)
+                    requests = []
+            if requests:
+                converted += await _write(db, collection, requests)
+    if converted:
+        logger.info(f"Converted {converted} string timestamps to dates")
+    return converted
+
+
+async def _write(db, collection: str, requests: list) -> int:
+    try:
+        result = await db[collection].bulk_write(requests, ordered=False)
+    except PyMongoError as e:
+        logger.error(f"Migration batch failed for {collection}: {e}")
+        return 0
+    return result.modified_count
+
+
+async def backfill_location_paths(db, locations, batch_size: int = 1000) -> int:
+    """Resolve location_path for listings that predate it; returns how many were resolved"""
+    resolved = 0
+    requests = []
+    query = {"location_path": {"$exists": False}}
+    async for listing in db.listings.find(query, {"_id": 1, "location": 1}):
+        location, path = locations.resolve(listing.get("location") or {})
+        # Unresolvable listings get an explicit None so they aren't retried each start
+        update = {"location_path": path}
+        if path:
+            update["location"] = location
+            resolved += 1
+        requests.append(UpdateOne({"_id": listing["_id"], **query}, {"$set": update}))
+        if len(requests) >= batch_size:
+            await _write(db, "listings", requests)
+            requests = []
+    if requests:
+        await _write(db, "listings", requests)
+    if resolved:
+        logger.info(f"Backfilled location_path on {resolved} listings")
+    return resolved
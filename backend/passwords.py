@@ -0,0 +1,69 @@
+"""Password hashing off the event loop.
+
+bcrypt is deliberately slow (~250 ms at cost 12). Hashes and verifications
+run in a dedicated thread pool (bcrypt releases the GIL while it works), and
+the number of waiting calls is capped so a login storm is answered with 503s
+instead of an ever-growing backlog.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashing calls are already waiting."""
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_queue: int = 64):
+        # Hashes made with a different cost report needs_update, so they are
+        # transparently rehashed on the next successful login
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Calls waiting for a free hashing thread"""
+        return max(0, self.in_flight - self.max_workers)
+
+    async def _run(self, fn, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise HasherBusy()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> tuple:
+        """Return (valid, new_hash); new_hash is set when the stored hash should be replaced"""
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
@@ -0,0 +1,141 @@
+"""Real-time events pushed to connected WebSocket clients.
+
+``Hub`` keeps this process's sockets per user and fans events out to them.
+Events travel through a ``Broker`` so they reach users connected to any API
+node: ``InProcessBroker`` hands them straight back to the local hub, which is
+all a single node needs. A multi-node deployment plugs in a broker over Redis
+pub/sub, NATS, ... implementing the same three methods.
+
+Each socket has a bounded send queue. A client that falls too far behind is
+disconnected (close code 1013) rather than buffered without limit; it
+reconnects and resyncs over the REST endpoints.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Iterable
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[list, str], Awaitable[None]]
+
+# Put on a connection's queue to make its sender close the socket
+_OVERFLOW = object()
+
+
+class Broker:
+    """Carries encoded events between API nodes."""
+
+    async def start(self, deliver: Deliver) -> None:
+        """Begin handing events for any node to ``deliver(user_ids, data)``"""
+        raise NotImplementedError
+
+    async def publish(self, user_ids: list, data: str) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        pass
+
+
+class InProcessBroker(Broker):
+    """Single-node broker: published events go straight to the local hub."""
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, user_ids: list, data: str) -> None:
+        await self._deliver(user_ids, data)
+
+
+class _Connection:
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+
+class Hub:
+    def __init__(self, broker: Broker = None, queue_size: int = 100, send_timeout: float = 10):
+        self.broker = broker or InProcessBroker()
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._connections = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.overflowed = 0
+
+    async def start(self) -> None:
+        await self.broker.start(self._deliver)
+
+    async def stop(self) -> None:
+        await self.broker.stop()
+        for connections in list(self._connections.values()):
+            for connection in list(connections):
+                try:
+                    await connection.websocket.close(code=1001)
+                except RuntimeError:
+                    pass
+
+    async def publish(self, user_ids: Iterable[str], event: dict) -> None:
+        """Send ``event`` to every socket of ``user_ids``, on any node"""
+        # Encoded once, however many sockets receive it
+        data = json.dumps(event, separators=(",", ":"), default=str)
+        self.published += 1
+        await self.broker.publish(list(dict.fromkeys(user_ids)), data)
+
+    async def _deliver(self, user_ids: list, data: str) -> None:
+        for user_id in user_ids:
+            for connection in self._connections.get(user_id, ()):
+                try:
+                    connection.queue.put_nowait(data)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    logger.warning(f"Disconnecting slow WebSocket client of user {user_id}")
+                    self.overflowed += 1
+                    while not connection.queue.empty():
+                        connection.queue.get_nowait()
+                    connection.queue.put_nowait(_OVERFLOW)
+
+    async def serve(self, user_id: str, websocket: WebSocket) -> None:
+        """Run an accepted socket until it disconnects"""
+        connection = _Connection(websocket, self.queue_size)
+        self._connections[user_id].add(connection)
+        sender = asyncio.create_task(self._send(connection))
+        try:
+            # Clients don't send anything we act on; reading notices disconnects
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            connections = self._connections[user_id]
+            connections.discard(connection)
+            if not connections:
+                del self._connections[user_id]
+
+    async def _send(self, connection: _Connection) -> None:
+        while True:
+            data = await connection.queue.get()
+            try:
+                if data is _OVERFLOW:
+                    await connection.websocket.close(code=1013)
+                    return
+                await asyncio.wait_for(connection.websocket.send_text(data), self.send_timeout)
+            except asyncio.TimeoutError:
+                await connection.websocket.close(code=1013)
+                return
+            except (WebSocketDisconnect, RuntimeError):
+                # Socket closed while we were sending
+                return
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._connections),
+            "connections": sum(len(c) for c in self._connections.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflowed": self.overflowed,
+        }
@@ -0,0 +1,99 @@
+"""JSON responses that validate and serialize rows in a single pass.
+
+When a handler returns dicts under a ``response_model``, FastAPI validates
+every row into a model, dumps it back to Python objects, runs
+``jsonable_encoder`` over the result and finally ``json.dumps``. On list
+endpoints that is most of the request's CPU. Here rows are validated by a
+cached ``TypeAdapter`` and written straight to JSON bytes by pydantic-core,
+which is as fast as orjson without adding a dependency.
+
+Routes keep their ``response_model`` for the OpenAPI schema; FastAPI passes a
+returned ``Response`` through without touching it.
+
+Exports use NDJSON, one document per line, so clients can process records as
+they arrive. Every line carries the ``cursor`` to resume after it, so an
+export cut off at any point picks up from the last complete line.
+"""
+import json
+from functools import lru_cache
+from typing import AsyncIterable, List
+
+from pydantic import TypeAdapter
+from starlette.responses import Response, StreamingResponse
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+
+
+@lru_cache(maxsize=None)
+def adapter(tp) -> TypeAdapter:
+    """Building an adapter compiles a validator, so each type gets one for the process"""
+    return TypeAdapter(tp)
+
+
+def dump_json(tp, content) -> bytes:
+    ta = adapter(tp)
+    return ta.dump_json(ta.validate_python(content))
+
+
+def json_response(tp, content, status_code: int = 200, headers: dict = None) -> Response:
+    """``content`` validated as ``tp`` (e.g. ``List[Listing]``) and rendered as JSON"""
+    return Response(dump_json(tp, content), status_code=status_code, headers=headers, media_type=JSON)
+
+
+async def _json_array(model, rows: AsyncIterable, batch_size: int):
+    tp = List[model]
+    separator = b"["
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            # Dump the batch as an array and splice its elements into ours
+            yield separator + dump_json(tp, batch)[1:-1]
+            separator = b","
+            batch = []
+    if batch:
+        yield separator + dump_json(tp, batch)[1:-1]
+        separator = b","
+    yield b"]" if separator == b"," else b"[]"
+
+
+def stream_json_array(model, rows: AsyncIterable, batch_size: int = 100, headers: dict = None) -> StreamingResponse:
+    """Stream ``rows`` (e.g. a Motor cursor) as a JSON array of ``model``.
+
+    Only one batch is held in memory at a time, and the first bytes go out
+    before the query has finished.
+    """
+    return StreamingResponse(_json_array(model, rows, batch_size), headers=headers, media_type=JSON)
+
+
+async def _ndjson(model, rows: AsyncIterable, limit: int, batch_size: int):
+    ta = adapter(model)
+    lines = []
+    sent = 0
+    async for row in rows:
+        if limit is not None and sent == limit:
+            # The cursor was asked for one row past the limit: more remain
+            lines.append(json.dumps({"next_cursor": str(last_id)}).encode() + b"\n")
+            break
+        last_id = row["_id"]
+        # Models drop _id, so the resume key is spliced in as the first field
+        document = ta.dump_json(ta.validate_python(row))
+        lines.append(b'{"cursor":"%s",' % str(last_id).encode() + document[1:] + b"\n")
+        sent += 1
+        if len(lines) >= batch_size:
+            yield b"".join(lines)
+            lines = []
+    if lines:
+        yield b"".join(lines)
+
+
+def stream_ndjson(model, rows: AsyncIterable, limit: int = None, batch_size: int = 100) -> StreamingResponse:
+    """Stream ``rows`` as NDJSON lines of ``model``.
+
+    ``rows`` must be sorted by ``_id`` and include it; each line gets the
+    row's ``_id`` as ``"cursor"``. With a ``limit``, query ``limit + 1`` rows:
+    if the extra one arrives, a final ``{"next_cursor": "<_id>"}`` line says
+    more remain.
+    """
+    return StreamingResponse(_ndjson(model, rows, limit, batch_size), media_type=NDJSON)
@@ -1,49 +1,151 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Request, Response, WebSocket, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
 import os
 import logging
 from pathlib import Path
+from urllib.parse import urlparse
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 import uuid
+import asyncio
+import base64
+import hashlib
+import time
+import json
 from datetime import datetime, timezone, timedelta
 import jwt
-from passlib.context import CryptContext
 import shutil
-from PIL import Image, ImageDraw, ImageFont
 import cv2
-import subprocess
 import aiofiles
-from PIL import Image, ImageDraw, ImageFont
-from fastapi import BackgroundTasks
+from indexes import ensure_indexes, index_report
+from migrations import backfill_location_paths, migrate_dates
+from conversations import backfill_conversations, mark_read, record_message
+from realtime import Hub
+from locations import LocationStore
+from listing_filters import CompiledFilter, ListingFilter, QueryPlans, compile_filter
+from serialization import json_response, stream_json_array, stream_ndjson
+from cache import TTLCache
+from view_counter import ViewCounter
+from counters import SHAPE, ListingCounters
+from passwords import HasherBusy, PasswordHasher
+from media import (
+    IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, MediaProcessor, QueueFull,
+    default_workers, default_video_workers, plan_variants, read_image_size,
+)
+from PIL import UnidentifiedImageError
+from media_files import etag_matches, serve_file
+from storage import IMMUTABLE, REVALIDATE, storage_from_env
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Dates come back as aware UTC datetimes, matching what the API writes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    rounds=int(os.environ.get('BCRYPT_ROUNDS', '12')),
+    max_workers=int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 2)),
+    max_queue=int(os.environ.get('BCRYPT_MAX_QUEUE', '64')),
+)
 SECRET_KEY = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 security = HTTPBearer()
 
+# Short-lived cache for the anonymous listing grid and its page counts
+listing_cache = TTLCache(
+    maxsize=int(os.environ.get('LISTING_CACHE_SIZE', '512')),
+    ttl=float(os.environ.get('LISTING_CACHE_TTL', '30')),
+)
+
+# Decoded JWT payloads (keyed by token hash) and the users they resolve to
+token_cache = TTLCache(maxsize=int(os.environ.get('AUTH_CACHE_SIZE', '10000')), ttl=float(os.environ.get('AUTH_CACHE_TTL', '60')))
+user_cache = TTLCache(maxsize=int(os.environ.get('AUTH_CACHE_SIZE', '10000')), ttl=float(os.environ.get('AUTH_CACHE_TTL', '60')))
+
+# Detail-page views, flushed to Mongo in batches
+view_counter = ViewCounter(interval=float(os.environ.get('VIEW_FLUSH_INTERVAL', '10')))
+
+# Listing counts per status/category/gender, and the user count
+counters = ListingCounters(interval=float(os.environ.get('COUNTER_RECONCILE_INTERVAL', '3600')))
+# Projection of the fields the counters are keyed by
+SHAPE_FIELDS = {"_id": 0, **{field: 1 for field in SHAPE}}
+
+# Index usage of each listing filter shape
+listing_plans = QueryPlans()
+
 # Create uploads directory
 UPLOADS_DIR = ROOT_DIR / 'uploads'
 UPLOADS_DIR.mkdir(exist_ok=True)
+# Uploads land here while they're hashed; the leading dot keeps it unservable
+INCOMING_DIR = UPLOADS_DIR / '.incoming'
+INCOMING_DIR.mkdir(exist_ok=True)
+
+# Where uploaded media is kept: local disk (default) or an S3-compatible bucket
+storage = storage_from_env(UPLOADS_DIR)
+
+# Process pool and ffmpeg queue for upload watermarking, plus upload garbage collection
+media_processor = MediaProcessor(
+    storage,
+    max_workers=int(os.environ.get('MEDIA_WORKERS', default_workers())),
+    max_pending=int(os.environ.get('MEDIA_MAX_PENDING', '100')),
+    video_workers=int(os.environ.get('MEDIA_VIDEO_WORKERS', default_video_workers())),
+    video_timeout=float(os.environ.get('MEDIA_VIDEO_TIMEOUT', '600')),
+    video_retries=int(os.environ.get('MEDIA_VIDEO_RETRIES', '2')),
+    gc_grace=float(os.environ.get('MEDIA_GC_GRACE', '86400')),
+    lease=float(os.environ.get('MEDIA_JOB_LEASE', '300')),
+)
+
+# Pushes new messages to connected clients
+hub = Hub()
+
+# Location hierarchy, reloaded when locations.json changes
+location_store = LocationStore(ROOT_DIR / "locations.json")
+
+# Widths of the resized copies made for every uploaded image
+IMAGE_WIDTHS = [int(w) for w in os.environ.get('MEDIA_IMAGE_WIDTHS', '320,640,1280').split(',')]
 
 # Create the main app
 app = FastAPI()
 
-# Mount static files for uploads
-app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+# Upload ids whose processing has finished, so their files can be served as immutable
+settled_uploads = TTLCache(maxsize=10000, ttl=3600)
+
+@app.api_route("/uploads/{filename}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_upload(filename: str, request: Request):
+    if filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not storage.is_local:
+        # Stored URLs keep pointing here; the bytes come straight from the bucket
+        return Response(
+            status_code=307,
+            headers={"Location": await storage.url(filename), "Cache-Control": "private, max-age=300"},
+        )
+    
+    file_path = storage.local_path(filename)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    # Variants are named {upload_id}_{width}.ext
+    upload_id = Path(filename).stem.split("_")[0]
+    cache_control = IMMUTABLE
+    if not settled_uploads.get(upload_id):
+        job = await db.media_jobs.find_one({"id": upload_id}, {"_id": 0, "status": 1})
+        # A failed job still holds the unwatermarked upload, which a retry replaces
+        if job and job["status"] != "done":
+            cache_control = REVALIDATE
+        else:
+            settled_uploads.set(upload_id, True)
+    
+    return serve_file(request, file_path, cache_control)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -102,10 +204,12 @@ class Listing(BaseModel):
     pricing_tiers: List[dict] = []  # [{"hours": 1, "price": 100}, {"hours": 2, "price": 180}]
     services: List[str] = []  # ["Massage", "Companionship", "Travel"]
     location: dict | str = {}  # {"country": "UK", "region": "Dorset", "city": "Bournemouth", "district": "Winton"} or "City, Country"
+    location_path: Optional[str] = None  # "uk/dorset/bournemouth/winton" when the location is in locations.json
     category: str
     phone: Optional[str] = None
     email: Optional[str] = None
     images: List[str] = []
+    image_variants: List[dict] = []  # [{"src": url, "variants": [{"width": 320, "webp": url, "jpeg": url}]}], aligned with images
     videos: List[str] = []
     user_id: str
     user_name: str
@@ -114,6 +218,34 @@ class Listing(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     views: int = 0
 
+class ListingCard(BaseModel):
+    """What a listing grid card shows: no description, media or pricing details, first image only"""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    title: str
+    age: Optional[int] = None
+    race: Optional[str] = None
+    gender: Optional[str] = None
+    price: float
+    location: dict | str = {}
+    category: str
+    phone: Optional[str] = None
+    images: List[str] = []
+    image_variants: List[dict] = []
+    featured: bool = False
+    status: str = "pending"
+    created_at: datetime
+    views: int = 0
+
+class ListingPage(BaseModel):
+    items: List[Union[Listing, ListingCard]]
+    total: int
+    next_cursor: Optional[str] = None
+
+class ListingBatch(BaseModel):
+    ids: List[str] = Field(..., max_length=100)
+    count_views: bool = False  # count a view for each listing found, as GET /listings/{id} does
+
 class MessageCreate(BaseModel):
     to_user_id: str
     listing_id: str
@@ -129,6 +261,15 @@ class Message(BaseModel):
     read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class Conversation(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str  # "{listing_id}:{counterpart_id}"
+    listing_id: str
+    counterpart_id: str
+    last_message: Message
+    last_message_at: datetime
+    unread: int = 0
+
 class Favorite(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -139,13 +280,27 @@ class Favorite(BaseModel):
 class AdminAction(BaseModel):
     status: str  # approved or rejected
 
+class UploadPresign(BaseModel):
+    filename: str
+    content_type: str
+
+class UploadComplete(BaseModel):
+    key: str
+
 # ============ AUTH HELPERS ============
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "2"})
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> tuple:
+    """Return (valid, new_hash); new_hash is set when the hash uses an outdated cost"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "2"})
 
 def create_token(user_id: str) -> str:
     payload = {
@@ -155,14 +310,27 @@ def create_token(user_id: str) -> str:
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    return await user_from_token(credentials.credentials)
+
+async def user_from_token(token: str) -> dict:
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_key = hashlib.sha256(token.encode()).hexdigest()
+        payload = token_cache.get(token_key)
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            token_cache.set(token_key, payload)
+        elif payload["exp"] <= time.time():
+            token_cache.pop(token_key)
+            raise jwt.ExpiredSignatureError()
         user_id = payload.get("sub")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await db.users.find_one({"id": user_id}, {"_id": 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user_id, user)
+        # Handlers may modify the user they're given; keep the cached copy intact
+        return dict(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -183,10 +351,13 @@ async def register(user_data: UserCreate):
         name=user_data.name
     )
     user_dict = user.model_dump()
-    user_dict["password"] = hash_password(user_data.password)
-    user_dict["created_at"] = user_dict["created_at"].isoformat()
+    user_dict["password"] = await hash_password(user_data.password)
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await counters.users_changed(db, 1)
     
     token = create_token(user.id)
     return TokenResponse(token=token, user=user)
@@ -194,11 +365,17 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if isinstance(user["created_at"], str):
-        user["created_at"] = datetime.fromisoformat(user["created_at"])
+    valid, new_hash = await verify_password(credentials.password, user["password"])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Rehash with the current BCRYPT_ROUNDS
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password": new_hash}})
+        user_cache.pop(user["id"])
     
     user_obj = User(**{k: v for k, v in user.items() if k != "password"})
     token = create_token(user["id"])
@@ -206,139 +383,255 @@ async def login(credentials: UserLogin):
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: dict = Depends(get_current_user)):
-    if isinstance(current_user["created_at"], str):
-        current_user["created_at"] = datetime.fromisoformat(current_user["created_at"])
     return User(**{k: v for k, v in current_user.items() if k != "password"})
 
 # ============ FILE UPLOAD ============
 
 
 
-def add_watermark_to_image(image_path: Path) -> Path:
-    try:
-        img = Image.open(image_path).convert("RGBA")
-        width, height = img.size
-
-        overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
-
-        watermark_text = "velvetroom"
-
-        # Scale font nicely
-        font_size = max(24, int(min(width, height) * 0.08))
-
-        try:
-            font = ImageFont.truetype(
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                font_size
-            )
-        except Exception:
-            font = ImageFont.load_default()
-
-        # ✅ Correct Pillow 10+ measurement
-        bbox = draw.textbbox((0, 0), watermark_text, font=font)
-        text_w = bbox[2] - bbox[0]
-        text_h = bbox[3] - bbox[1]
-
-        # ✅ CENTER POSITION
-        x = (width - text_w) // 2
-        y = (height - text_h) // 2
-
-        # Semi-transparent background box (important for visibility)
-        padding = 20
-        draw.rectangle(
-            (
-                x - padding,
-                y - padding,
-                x + text_w + padding,
-                y + text_h + padding
-            ),
-            fill=(0, 0, 0, 120)
-        )
-
-        # Watermark text
-        draw.text(
-            (x, y),
-            watermark_text,
-            fill=(255, 255, 255, 200),
-            font=font
-        )
+def upload_url(filename: str) -> str:
+    backend_url = os.environ.get("BACKEND_URL", "https://durexethiopia.com")
+    return f"{backend_url}/uploads/{filename}"
+
+def variant_urls(variants: List[dict]) -> List[dict]:
+    return [
+        {"width": v["width"], "webp": upload_url(v["webp"]), "jpeg": upload_url(v["jpeg"])}
+        for v in variants
+    ]
+
+def upload_id_from_url(url: str) -> Optional[str]:
+    """The upload id behind one of our /uploads/ URLs, None for anything else"""
+    path = urlparse(url).path
+    if not path.startswith("/uploads/"):
+        return None
+    return Path(path).stem
+
+def listing_upload_ids(listing: dict) -> List[str]:
+    urls = (listing.get("images") or []) + (listing.get("videos") or [])
+    return [upload_id for upload_id in map(upload_id_from_url, urls) if upload_id]
+
+async def resolve_image_variants(images: List[str]) -> List[dict]:
+    """Responsive variants for each image URL, in the same order as ``images``.
+
+    Only finished jobs have their variant files; the others are filled in by
+    fill_image_variants when they finish.
+    """
+    upload_ids = [upload_id_from_url(url) for url in images]
+    jobs = await db.media_jobs.find(
+        {"id": {"$in": [i for i in upload_ids if i]}, "status": "done"}, {"_id": 0, "id": 1, "variants": 1}
+    ).to_list(None)
+    variants = {job["id"]: job.get("variants", []) for job in jobs}
+    return [
+        {"src": url, "variants": variant_urls(variants.get(upload_id, []))}
+        for url, upload_id in zip(images, upload_ids)
+    ]
+
+async def fill_image_variants(db, job: dict) -> None:
+    """Advertise a finished image's variants on the listings already showing it"""
+    if not job.get("variants"):
+        return
+    url = upload_url(job["key"])
+    result = await db.listings.update_many(
+        {"image_variants.src": url},
+        {"$set": {"image_variants.$.variants": variant_urls(job["variants"])}},
+    )
+    if result.modified_count:
+        listing_cache.clear()
 
-        # Merge layers
-        watermarked = Image.alpha_composite(img, overlay)
+media_processor.on_done = fill_image_variants
 
-        # Save optimized (fast + good quality)
-        watermarked.convert("RGB").save(
-            image_path,
-            quality=85,
-            optimize=True
-        )
+def upload_kind(file_ext: str) -> Optional[str]:
+    if file_ext in IMAGE_EXTENSIONS:
+        return "image"
+    if file_ext in VIDEO_EXTENSIONS:
+        return "video"
+    return None
 
-        return image_path
+def check_media_queue(kind: Optional[str]) -> None:
+    if kind and media_processor.pending >= media_processor.max_pending:
+        raise HTTPException(status_code=503, detail="Media queue is full, try again shortly", headers={"Retry-After": "5"})
 
-    except Exception as e:
-        logger.error(f"Image watermark failed: {e}")
-        return image_path
+async def register_upload(tmp_path: Path, upload_id: str, file_ext: str, user_id: str) -> dict:
+    """Store a hashed upload under its content address and return the upload response.
 
-def add_watermark_to_video(video_path: Path) -> Path:
+    ``tmp_path`` is consumed, or left for the caller to remove when the bytes
+    were already stored.
+    """
+    kind = upload_kind(file_ext)
     try:
-        output_path = video_path.with_suffix(".wm.mp4")
-
-        cmd = [
-            "ffmpeg",
-            "-i", str(video_path),
-            "-vf",
-            "drawtext=text='VelvetRoom':x=w-tw-20:y=h-th-20:"
-            "fontsize=24:fontcolor=white@0.7:box=1:boxcolor=black@0.4",
-            "-preset", "veryfast",
-            "-codec:a", "copy",
-            "-y",
-            str(output_path),
-        ]
-
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        job = await db.media_jobs.find_one({"id": upload_id}, {"_id": 0})
+        
+        if job is None or (job["status"] == "failed" and job["kind"]):
+            # Plan the responsive sizes now so the response can already list them
+            variants = []
+            if kind == "image":
+                try:
+                    width, _ = await asyncio.to_thread(read_image_size, tmp_path)
+                except (UnidentifiedImageError, OSError):
+                    raise HTTPException(status_code=400, detail="Unsupported image file")
+                variants = plan_variants(upload_id, width, IMAGE_WIDTHS)
+            
+            # Watermark off the event loop
+            if job is None:
+                job = await media_processor.submit(
+                    db, upload_id, f"{upload_id}{file_ext}", kind, tmp_path, user_id, variants
+                )
+            else:
+                job = await media_processor.retry(db, upload_id, tmp_path, user_id) or job
+        else:
+            # Same bytes already stored: reuse them and skip processing
+            job = await media_processor.touch(db, upload_id, user_id)
+    except DuplicateKeyError:
+        # A concurrent upload of the same bytes registered it first
+        job = await media_processor.touch(db, upload_id, user_id)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Media queue is full, try again shortly", headers={"Retry-After": "5"})
 
-        video_path.unlink()
-        output_path.rename(video_path)
-
-        return video_path
+    return {
+        "id": job["id"],
+        "url": upload_url(job["key"]),
+        "type": "video" if job["kind"] == "video" else "image",
+        "status": job["status"] if job["kind"] else None,
+        "variants": variant_urls(job.get("variants", [])),
+    }
 
-    except Exception as e:
-        logger.error(f"Video watermark failed: {e}")
-        return video_path
+async def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    async with aiofiles.open(path, "rb") as f:
+        while chunk := await f.read(8 * 1024 * 1024):
+            await asyncio.to_thread(digest.update, chunk)
+    return digest.hexdigest()
 
 @api_router.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     current_user: dict = Depends(get_current_user),
 ):
     file_ext = Path(file.filename).suffix.lower()
-    filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = UPLOADS_DIR / filename
+    check_media_queue(upload_kind(file_ext))
+    
+    # Hash while streaming so identical uploads can share one stored copy
+    tmp_path = INCOMING_DIR / str(uuid.uuid4())
+    digest = hashlib.sha256()
 
     chunk_size = 8 * 1024 * 1024  # 8MB
 
-    async with aiofiles.open(file_path, "wb") as out_file:
-        while chunk := await file.read(chunk_size):
-            await out_file.write(chunk)
-
-    # 🔥 Watermark in background (NON-BLOCKING)
-    if file_ext in {".jpg", ".jpeg", ".png", ".webp"}:
-        background_tasks.add_task(add_watermark_to_image, file_path)
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out_file:
+            while chunk := await file.read(chunk_size):
+                # hashlib releases the GIL for large buffers
+                await asyncio.to_thread(digest.update, chunk)
+                await out_file.write(chunk)
+
+        return await register_upload(tmp_path, digest.hexdigest(), file_ext, current_user["id"])
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+@api_router.post("/uploads/presign")
+async def presign_upload(data: UploadPresign, current_user: dict = Depends(get_current_user)):
+    """Let the client PUT a file straight to the bucket, then call /uploads/complete"""
+    if storage.is_local:
+        raise HTTPException(status_code=400, detail="Direct uploads are not enabled")
+    file_ext = Path(data.filename).suffix.lower()
+    check_media_queue(upload_kind(file_ext))
+    
+    key = f"incoming/{current_user['id']}/{uuid.uuid4()}{file_ext}"
+    return {"key": key, **await storage.presign_upload(key, data.content_type)}
+
+@api_router.post("/uploads/complete")
+async def complete_upload(data: UploadComplete, current_user: dict = Depends(get_current_user)):
+    """Register a file the client uploaded to a presigned URL"""
+    if storage.is_local:
+        raise HTTPException(status_code=400, detail="Direct uploads are not enabled")
+    if not data.key.startswith(f"incoming/{current_user['id']}/") or ".." in data.key:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if not await storage.exists(data.key):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    file_ext = Path(data.key).suffix.lower()
+    check_media_queue(upload_kind(file_ext))
+    
+    # The bucket can't hash for us, so the bytes make one trip through the API
+    tmp_path = INCOMING_DIR / str(uuid.uuid4())
+    try:
+        await storage.download(data.key, tmp_path)
+        upload_id = await hash_file(tmp_path)
+        response = await register_upload(tmp_path, upload_id, file_ext, current_user["id"])
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    await storage.delete(data.key)
+    return response
+
+@api_router.get("/uploads/{upload_id}/status")
+async def get_upload_status(upload_id: str, current_user: dict = Depends(get_current_user)):
+    """Processing status of an upload: queued, processing, done or failed"""
+    job = await db.media_jobs.find_one({"id": upload_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    
+    if current_user["id"] not in job["user_ids"] and current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return {
+        "id": job["id"],
+        "type": job["kind"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "variants": variant_urls(job.get("variants", [])),
+        "error": job["error"],
+        "updated_at": job["updated_at"],
+    }
 
-    elif file_ext in {".mp4", ".mov", ".avi", ".webm"}:
-        background_tasks.add_task(add_watermark_to_video, file_path)
+# ============ PAGINATION HELPERS ============
 
-    backend_url = os.environ.get("BACKEND_URL", "https://durexethiopia.com")
+def encode_cursor(created_at: datetime, item_id: str) -> str:
+    """Opaque keyset cursor pointing just past (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), item_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-    return {
-        "url": f"{backend_url}/uploads/{filename}",
-        "type": "video" if file_ext in {".mp4", ".mov", ".avi", ".webm"} else "image",
-    }
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, item_id = json.loads(raw)
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, item_id
+
+def seek_after(cursor: str, field: str = "created_at") -> dict:
+    """Query clause selecting items that sort after the cursor in (field, id) descending order"""
+    created_at, item_id = decode_cursor(cursor)
+    return {"$or": [
+        {field: {"$lt": created_at}},
+        {field: created_at, "id": {"$lt": item_id}},
+    ]}
+
+async def listing_filter(spec: ListingFilter) -> CompiledFilter:
+    """Compiled query for a listing filter; the first query of each shape is explained"""
+    compiled = compile_filter(spec, await location_store.get())
+    listing_plans.observe(db, compiled)
+    return compiled
+
+def listing_cache_key(kind: str, **params) -> tuple:
+    """Normalized, hashable key for a listing query; unset filters are dropped"""
+    return (kind,) + tuple(sorted((k, v) for k, v in params.items() if v is not None and v != ""))
 
 # ============ LISTING ROUTES ============
 
+ListingView = Literal["full", "card"]
+
+def listing_projection(view: ListingView, pipeline: bool = False) -> dict:
+    """find() projection for a view, or the equivalent $project stage body with pipeline=True"""
+    if view == "card":
+        projection = {field: 1 for field in ListingCard.model_fields}
+        if pipeline:
+            # $slice of a missing field is null; listings from before image_variants lack it
+            first = {field: {"$slice": [{"$ifNull": [f"${field}", []]}, 1]} for field in ("images", "image_variants")}
+        else:
+            first = {"images": {"$slice": 1}, "image_variants": {"$slice": 1}}
+        projection.update({"_id": 0, **first})
+        return projection
+    return {"_id": 0}
+
 @api_router.post("/listings", response_model=Listing)
 async def create_listing(
     title: str = Form(...),
@@ -358,7 +651,8 @@ async def create_listing(
     current_user: dict = Depends(get_current_user)
 ):
     import json
-    location_obj = json.loads(location) if location else {}
+    locations = await location_store.get()
+    location_obj, location_path = locations.resolve(json.loads(location) if location else {})
     
     listing = Listing(
         title=title,
@@ -368,10 +662,12 @@ async def create_listing(
         gender=gender,
         price=price,
         location=location_obj,
+        location_path=location_path,
         category=category,
         phone=phone,
         email=email,
         images=images if images else [],
+        image_variants=await resolve_image_variants(images) if images else [],
         videos=videos if videos else [],
         pricing_tiers=json.loads(pricing_tiers) if pricing_tiers else [],
         services=json.loads(services) if services else [],
@@ -380,12 +676,14 @@ async def create_listing(
     )
     
     listing_dict = listing.model_dump()
-    listing_dict["created_at"] = listing_dict["created_at"].isoformat()
     
     await db.listings.insert_one(listing_dict)
+    await counters.listing_changed(db, after=listing_dict)
+    await media_processor.update_refs(db, added=listing_upload_ids(listing_dict))
+    listing_cache.clear()
     return listing
 
-@api_router.get("/listings", response_model=List[Listing])
+@api_router.get("/listings", response_model=List[Union[Listing, ListingCard]])
 async def get_listings(
     status: str = "approved",
     category: Optional[str] = None,
@@ -399,51 +697,55 @@ async def get_listings(
     search: Optional[str] = None,
     featured: Optional[bool] = None,
     page: int = 1,
-    limit: int = 20
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    view: ListingView = "full",
+    response: Response = None
 ):
-    query = {"status": status}
-    
-    if category:
-        query["category"] = category
-    if gender:
-        query["gender"] = gender
-    if race:
-        query["race"] = race
-    if min_age is not None:
-        query["age"] = query.get("age", {})
-        query["age"]["$gte"] = min_age
-    if max_age is not None:
-        query["age"] = query.get("age", {})
-        query["age"]["$lte"] = max_age
-    if location:
-        query["$or"] = [
-            {"location.city": {"$regex": location, "$options": "i"}},
-            {"location.district": {"$regex": location, "$options": "i"}},
-            {"location.region": {"$regex": location, "$options": "i"}},
-            {"location.country": {"$regex": location, "$options": "i"}},
-        ]
-    if min_price is not None:
-        query["price"] = query.get("price", {})
-        query["price"]["$gte"] = min_price
-    if max_price is not None:
-        query["price"] = query.get("price", {})
-        query["price"]["$lte"] = max_price
-    if search:
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
-    if featured is not None:
-        query["featured"] = featured
-    
-    # Calculate skip for pagination
-    skip = (page - 1) * limit
+    """List listings newest first. Pass the X-Next-Cursor header back as `cursor` to seek to the next page.
+
+    `view=card` returns the slim ListingCard shape used by the grid.
+    """
+    limit = min(max(limit, 1), 100)
+    page = max(page, 1)
+    spec = ListingFilter.from_params(
+        status=status, category=category, gender=gender, race=race, min_age=min_age, max_age=max_age,
+        location=location, min_price=min_price, max_price=max_price, search=search, featured=featured,
+    )
+    projection = listing_projection(view)
+    if spec.search:
+        projection["score"] = {"$meta": "textScore"}
+        # Relevance order has no (created_at, id) keyset, so searches page by number
+        cursor = None
     
-    listings = await db.listings.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    async def fetch():
+        compiled = await listing_filter(spec)
+        query = compiled.query
+        if cursor:
+            query = {**query, "$and": [seek_after(cursor)]}
+        cursor_query = db.listings.find(query, projection).sort(list(compiled.sort))
+        if compiled.hint:
+            cursor_query = cursor_query.hint(compiled.hint)
+        if not cursor:
+            # Calculate skip for pagination
+            cursor_query = cursor_query.skip((page - 1) * limit)
+        
+        # Fetch one extra row to learn whether another page exists
+        listings = await cursor_query.limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(listings) > limit:
+            listings = listings[:limit]
+            if not spec.search:
+                next_cursor = encode_cursor(listings[-1]["created_at"], listings[-1]["id"])
+        
+        return listings, next_cursor
     
-    for listing in listings:
-        if isinstance(listing["created_at"], str):
-            listing["created_at"] = datetime.fromisoformat(listing["created_at"])
+    cache_key = listing_cache_key(
+        "listings", filter=spec, limit=limit, page=None if cursor else page, cursor=cursor, view=view
+    )
+    listings, next_cursor = await listing_cache.get_or_load(cache_key, fetch)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return listings
 
@@ -454,26 +756,117 @@ async def get_listings_count(
     gender: Optional[str] = None,
     race: Optional[str] = None,
     min_age: Optional[int] = None,
-    max_age: Optional[int] = None
+    max_age: Optional[int] = None,
+    location: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    featured: Optional[bool] = None
 ):
-    """Get total count of listings for pagination"""
-    query = {"status": status}
-    
-    if category:
-        query["category"] = category
-    if gender:
-        query["gender"] = gender
-    if race:
-        query["race"] = race
-    if min_age is not None:
-        query["age"] = query.get("age", {})
-        query["age"]["$gte"] = min_age
-    if max_age is not None:
-        query["age"] = query.get("age", {})
-        query["age"]["$lte"] = max_age
-    
-    total = await db.listings.count_documents(query)
-    return {"total": total}
+    """Get total count of listings for pagination; takes the same filters as GET /listings"""
+    spec = ListingFilter.from_params(
+        status=status, category=category, gender=gender, race=race, min_age=min_age, max_age=max_age,
+        location=location, min_price=min_price, max_price=max_price, search=search, featured=featured,
+    )
+    
+    return {"total": await count_listings(spec)}
+
+async def count_listings(spec: ListingFilter) -> int:
+    """Listings matching a filter, cached alongside the pages"""
+    async def load():
+        if spec.counter_only():
+            # Only counter dimensions: a few counter documents instead of a scan
+            return await counters.count_listings(db, spec.status, spec.category, spec.gender)
+        compiled = await listing_filter(spec)
+        if compiled.hint:
+            return await db.listings.count_documents(compiled.query, hint=compiled.hint)
+        return await db.listings.count_documents(compiled.query)
+    
+    return await listing_cache.get_or_load(listing_cache_key("count", filter=spec), load)
+
+@api_router.get("/listings/page", response_model=ListingPage)
+async def get_listings_page(
+    status: str = "approved",
+    category: Optional[str] = None,
+    gender: Optional[str] = None,
+    race: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    location: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    featured: Optional[bool] = None,
+    page: int = 1,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    view: ListingView = "full"
+):
+    """A page of GET /listings and the total matching its filters.
+
+    Numbered pages come from one $facet aggregation. Pass `next_cursor` back as
+    `cursor` to seek to the next page; the seek is part of the indexed $match and
+    `total` (every match, not what is left after the cursor) comes from the same
+    cached count as GET /listings/count.
+    """
+    limit = min(max(limit, 1), 100)
+    page = max(page, 1)
+    spec = ListingFilter.from_params(
+        status=status, category=category, gender=gender, race=race, min_age=min_age, max_age=max_age,
+        location=location, min_price=min_price, max_price=max_price, search=search, featured=featured,
+    )
+    if spec.search:
+        cursor = None
+    
+    async def fetch():
+        compiled = await listing_filter(spec)
+        query = {**compiled.query, "$and": [seek_after(cursor)]} if cursor else compiled.query
+        # One extra row to learn whether another page exists
+        items = [{"$limit": limit + 1}, {"$project": listing_projection(view, pipeline=True)}]
+        pipeline = [
+            {"$match": query},
+            # Sorted up front, where the index can still provide the order
+            {"$sort": dict(compiled.sort)},
+        ]
+        if cursor:
+            listings = await db.listings.aggregate(pipeline + items, **compiled.command_options()).to_list(limit + 1)
+            total = await count_listings(spec)
+        else:
+            items.insert(0, {"$skip": (page - 1) * limit})
+            pipeline.append({"$facet": {"items": items, "total": [{"$count": "total"}]}})
+            result = (await db.listings.aggregate(pipeline, **compiled.command_options()).to_list(1))[0]
+            listings = result["items"]
+            total = result["total"][0]["total"] if result["total"] else 0
+        next_cursor = None
+        if len(listings) > limit:
+            listings = listings[:limit]
+            if not spec.search:
+                next_cursor = encode_cursor(listings[-1]["created_at"], listings[-1]["id"])
+        return {"items": listings, "total": total, "next_cursor": next_cursor}
+    
+    cache_key = listing_cache_key(
+        "page", filter=spec, limit=limit, page=None if cursor else page, cursor=cursor, view=view
+    )
+    return await listing_cache.get_or_load(cache_key, fetch)
+
+@api_router.post("/listings/batch", response_model=List[Listing])
+async def get_listings_batch(data: ListingBatch):
+    """Many listings by id in one query, in the order requested; unknown ids are skipped"""
+    ids = list(dict.fromkeys(data.ids))
+    listings = await db.listings.find({"id": {"$in": ids}}, {"_id": 0}).to_list(len(ids))
+    by_id = {listing["id"]: listing for listing in listings}
+    
+    ordered = []
+    for listing_id in ids:
+        listing = by_id.get(listing_id)
+        if not listing:
+            continue
+        if data.count_views:
+            view_counter.record(listing_id)
+        listing["views"] = listing.get("views", 0) + view_counter.pending(listing_id)
+        ordered.append(listing)
+    
+    return ordered
 
 @api_router.get("/listings/{listing_id}", response_model=Listing)
 async def get_listing(listing_id: str):
@@ -481,21 +874,17 @@ async def get_listing(listing_id: str):
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found")
     
-    # Increment views
-    await db.listings.update_one({"id": listing_id}, {"$inc": {"views": 1}})
-    
-    if isinstance(listing["created_at"], str):
-        listing["created_at"] = datetime.fromisoformat(listing["created_at"])
+    # Increment views (buffered, written back by the view counter)
+    view_counter.record(listing_id)
+    listing["views"] = listing.get("views", 0) + view_counter.pending(listing_id)
     
-    return Listing(**listing)
+    return json_response(Listing, listing)
 
-@api_router.get("/listings/user/me", response_model=List[Listing])
-async def get_my_listings(current_user: dict = Depends(get_current_user)):
-    listings = await db.listings.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
-    for listing in listings:
-        if isinstance(listing["created_at"], str):
-            listing["created_at"] = datetime.fromisoformat(listing["created_at"])
+@api_router.get("/listings/user/me", response_model=List[Union[Listing, ListingCard]])
+async def get_my_listings(view: ListingView = "full", current_user: dict = Depends(get_current_user)):
+    listings = await db.listings.find(
+        {"user_id": current_user["id"]}, listing_projection(view)
+    ).sort("created_at", -1).to_list(100)
     
     return listings
 
@@ -508,7 +897,12 @@ async def delete_listing(listing_id: str, current_user: dict = Depends(get_curre
     if listing["user_id"] != current_user["id"] and current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.listings.delete_one({"id": listing_id})
+    deleted = await db.listings.find_one_and_delete({"id": listing_id}, projection=SHAPE_FIELDS)
+    await counters.listing_changed(db, before=deleted)
+    listing_cache.clear()
+    
+    # Files nothing else uses are deleted by the media GC once the grace period passes
+    await media_processor.update_refs(db, removed=listing_upload_ids(listing))
     return {"message": "Listing deleted"}
 
 @api_router.put("/listings/{listing_id}", response_model=Listing)
@@ -536,28 +930,35 @@ async def update_listing(
     if listing["user_id"] != current_user["id"] and current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    location_obj = json.loads(location) if location else {}
+    locations = await location_store.get()
+    location_obj, location_path = locations.resolve(json.loads(location) if location else {})
     
     update_data = {
         "title": title,
         "description": description,
         "price": price,
         "location": location_obj,
+        "location_path": location_path,
         "category": category,
         "phone": phone,
         "email": email,
         "images": images if images else [],
+        "image_variants": await resolve_image_variants(images) if images else [],
         "videos": videos if videos else [],
         "pricing_tiers": json.loads(pricing_tiers) if pricing_tiers else [],
         "services": json.loads(services) if services else []
     }
     
-    await db.listings.update_one({"id": listing_id}, {"$set": update_data})
+    before = await db.listings.find_one_and_update(
+        {"id": listing_id}, {"$set": update_data}, projection=SHAPE_FIELDS, return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        await counters.listing_changed(db, before=before, after={**before, "category": category})
+    listing_cache.clear()
     
-    updated_listing = await db.listings.find_one({"id": listing_id}, {"_id": 0})
-    if isinstance(updated_listing["created_at"], str):
-        updated_listing["created_at"] = datetime.fromisoformat(updated_listing["created_at"])
+    await media_processor.update_refs(db, added=listing_upload_ids(update_data), removed=listing_upload_ids(listing))
     
+    updated_listing = await db.listings.find_one({"id": listing_id}, {"_id": 0})
     return Listing(**updated_listing)
 
 # ============ FAVORITES ============
@@ -571,9 +972,11 @@ async def add_favorite(listing_id: str = Form(...), current_user: dict = Depends
     
     favorite = Favorite(user_id=current_user["id"], listing_id=listing_id)
     favorite_dict = favorite.model_dump()
-    favorite_dict["created_at"] = favorite_dict["created_at"].isoformat()
     
-    await db.favorites.insert_one(favorite_dict)
+    try:
+        await db.favorites.insert_one(favorite_dict)
+    except DuplicateKeyError:
+        return {"message": "Already favorited"}
     return {"message": "Added to favorites"}
 
 @api_router.delete("/favorites/{listing_id}")
@@ -581,16 +984,12 @@ async def remove_favorite(listing_id: str, current_user: dict = Depends(get_curr
     await db.favorites.delete_one({"user_id": current_user["id"], "listing_id": listing_id})
     return {"message": "Removed from favorites"}
 
-@api_router.get("/favorites", response_model=List[Listing])
-async def get_favorites(current_user: dict = Depends(get_current_user)):
+@api_router.get("/favorites", response_model=List[Union[Listing, ListingCard]])
+async def get_favorites(view: ListingView = "full", current_user: dict = Depends(get_current_user)):
     favorites = await db.favorites.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(1000)
     listing_ids = [f["listing_id"] for f in favorites]
     
-    listings = await db.listings.find({"id": {"$in": listing_ids}}, {"_id": 0}).to_list(1000)
-    
-    for listing in listings:
-        if isinstance(listing["created_at"], str):
-            listing["created_at"] = datetime.fromisoformat(listing["created_at"])
+    listings = await db.listings.find({"id": {"$in": listing_ids}}, listing_projection(view)).to_list(1000)
     
     return listings
 
@@ -606,9 +1005,14 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
     )
     
     message_dict = message.model_dump()
-    message_dict["created_at"] = message_dict["created_at"].isoformat()
     
     await db.messages.insert_one(message_dict)
+    message_dict.pop("_id", None)
+    await record_message(db, message_dict)
+    await hub.publish(
+        [message.to_user_id, message.from_user_id],
+        {"type": "message", "message": message.model_dump(mode="json")},
+    )
     return message
 
 @api_router.get("/messages", response_model=List[Message])
@@ -618,27 +1022,87 @@ async def get_messages(current_user: dict = Depends(get_current_user)):
         {"_id": 0}
     ).sort("created_at", -1).to_list(1000)
     
-    for message in messages:
-        if isinstance(message["created_at"], str):
-            message["created_at"] = datetime.fromisoformat(message["created_at"])
-    
-    return messages
+    return json_response(List[Message], messages)
 
 @api_router.get("/messages/conversation/{listing_id}", response_model=List[Message])
-async def get_conversation(listing_id: str, current_user: dict = Depends(get_current_user)):
-    messages = await db.messages.find(
-        {
-            "listing_id": listing_id,
-            "$or": [{"from_user_id": current_user["id"]}, {"to_user_id": current_user["id"]}]
-        },
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(1000)
+async def get_conversation(
+    listing_id: str,
+    with_user: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    current_user: dict = Depends(get_current_user)
+):
+    """The latest `limit` messages of a thread, oldest first.
+
+    `with_user` narrows it to one counterpart. Pass the X-Next-Cursor header
+    back as `cursor` to load the messages before them.
+    """
+    limit = min(max(limit, 1), 100)
+    me = current_user["id"]
+    if with_user:
+        participants = [
+            {"from_user_id": me, "to_user_id": with_user},
+            {"from_user_id": with_user, "to_user_id": me},
+        ]
+    else:
+        participants = [{"from_user_id": me}, {"to_user_id": me}]
+    query = {"listing_id": listing_id, "$or": participants}
+    if cursor:
+        query["$and"] = [seek_after(cursor)]
+    
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(messages) > limit:
+        messages = messages[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(messages[-1]["created_at"], messages[-1]["id"])
+    messages.reverse()
+    
+    return json_response(List[Message], messages, headers=headers)
+
+@api_router.websocket("/ws")
+async def websocket_events(websocket: WebSocket, token: str):
+    """Pushes {"type": "message", "message": {...}} for messages sent or received.
+
+    Browsers can't set headers on a WebSocket, so the JWT comes as ?token=.
+    """
+    try:
+        user = await user_from_token(token)
+    except HTTPException:
+        # Closing before accept rejects the handshake
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    await hub.serve(user["id"], websocket)
+
+@api_router.get("/conversations", response_model=List[Conversation])
+async def get_conversations(
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """Inbox: one row per (listing, counterpart), most recent first, with unread counts"""
+    limit = min(max(limit, 1), 100)
+    query = {"user_id": current_user["id"]}
+    if cursor:
+        query["$and"] = [seek_after(cursor, "last_message_at")]
     
-    for message in messages:
-        if isinstance(message["created_at"], str):
-            message["created_at"] = datetime.fromisoformat(message["created_at"])
+    conversations = await db.conversations.find(query, {"_id": 0}).sort(
+        [("last_message_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last["last_message_at"], last["id"])
     
-    return messages
+    return json_response(List[Conversation], conversations, headers=headers)
+
+@api_router.post("/conversations/{listing_id}/{counterpart_id}/read")
+async def mark_conversation_read(listing_id: str, counterpart_id: str, current_user: dict = Depends(get_current_user)):
+    marked = await mark_read(db, current_user["id"], listing_id, counterpart_id)
+    return {"marked_read": marked}
 
 # ============ ADMIN ROUTES ============
 
@@ -647,31 +1111,59 @@ async def get_all_users(current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    users = await db.users.find({}, {"_id": 0, "password": 0}).sort("created_at", -1).to_list(1000)
-    
-    for user in users:
-        if isinstance(user.get("created_at"), str):
-            user["created_at"] = datetime.fromisoformat(user["created_at"])
-        if isinstance(user.get("last_active"), str):
-            user["last_active"] = datetime.fromisoformat(user["last_active"])
-        if user.get("vip_expiry") and isinstance(user["vip_expiry"], str):
-            user["vip_expiry"] = datetime.fromisoformat(user["vip_expiry"])
+    users = db.users.find({}, {"_id": 0, "password": 0}).sort("created_at", -1).limit(1000)
+    return stream_json_array(User, users)
+
+def export_cursor(collection, query: dict, projection: Optional[dict], after: Optional[str], limit: Optional[int]):
+    """Motor cursor over ``query`` in _id order, resuming after the ``after`` cursor"""
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    if after:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = {**query, "_id": {"$gt": ObjectId(after)}}
+    cursor = collection.find(query, projection).sort("_id", 1).batch_size(500)
+    if limit is not None:
+        cursor = cursor.limit(limit + 1)
+    return cursor
+
+@api_router.get("/admin/users/export")
+async def export_users(
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """All users as NDJSON. Pass the `cursor` of the last line received back as `after` to resume;
+    with a limit, a trailing {"next_cursor": ...} line says more remain.
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
     
-    return users
+    users = export_cursor(db.users, {}, {"password": 0}, after, limit)
+    return stream_ndjson(User, users, limit)
 
 @api_router.delete("/admin/users/{user_id}")
 async def delete_user(user_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    # Delete user's listings
+    # Delete user's listings, releasing the media they reference
+    listings = await db.listings.find({"user_id": user_id}, {**SHAPE_FIELDS, "images": 1, "videos": 1}).to_list(None)
     await db.listings.delete_many({"user_id": user_id})
+    await counters.listings_changed(db, before=listings)
+    upload_ids = [upload_id for listing in listings for upload_id in listing_upload_ids(listing)]
+    await media_processor.update_refs(db, removed=upload_ids)
     # Delete user's messages
     await db.messages.delete_many({"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]})
+    await db.conversations.delete_many({"$or": [{"user_id": user_id}, {"counterpart_id": user_id}]})
     # Delete user's favorites
     await db.favorites.delete_many({"user_id": user_id})
     # Delete user
-    await db.users.delete_one({"id": user_id})
+    result = await db.users.delete_one({"id": user_id})
+    if result.deleted_count:
+        await counters.users_changed(db, -1)
+    user_cache.pop(user_id)
+    listing_cache.clear()
     
     return {"message": "User and all associated data deleted"}
 
@@ -696,8 +1188,9 @@ async def toggle_vip_status(
     
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"vip_status": True, "vip_expiry": vip_expiry.isoformat()}}
+        {"$set": {"vip_status": True, "vip_expiry": vip_expiry}}
     )
+    user_cache.pop(user_id)
     
     return {"message": f"VIP status granted for {days} days"}
 
@@ -718,13 +1211,15 @@ async def update_user_status(
         {"id": user_id},
         {"$set": {"status": status}}
     )
+    user_cache.pop(user_id)
     
     # If user is suspended, also suspend all their listings
     if status == "suspended":
-        await db.listings.update_many(
-            {"user_id": user_id},
-            {"$set": {"status": "rejected"}}
-        )
+        query = {"user_id": user_id, "status": {"$ne": "rejected"}}
+        listings = await db.listings.find(query, SHAPE_FIELDS).to_list(None)
+        await db.listings.update_many(query, {"$set": {"status": "rejected"}})
+        await counters.listings_changed(db, listings, [{**listing, "status": "rejected"} for listing in listings])
+        listing_cache.clear()
     
     return {"message": f"User status updated to {status}"}
 
@@ -769,10 +1264,15 @@ async def admin_edit_listing(
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    await db.listings.update_one(
+    before = await db.listings.find_one_and_update(
         {"id": listing_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection=SHAPE_FIELDS,
+        return_document=ReturnDocument.BEFORE
     )
+    if before:
+        await counters.listing_changed(db, before=before, after={**before, **update_data})
+    listing_cache.clear()
     
     return {"message": "Listing updated successfully"}
 
@@ -784,13 +1284,23 @@ async def get_admin_listings(
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    listings = await db.listings.find({"status": status}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    
-    for listing in listings:
-        if isinstance(listing["created_at"], str):
-            listing["created_at"] = datetime.fromisoformat(listing["created_at"])
+    listings = db.listings.find({"status": status}, {"_id": 0}).sort("created_at", -1).limit(1000)
+    return stream_json_array(Listing, listings)
+
+@api_router.get("/admin/listings/export")
+async def export_listings(
+    status: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Listings (all, or one status) as NDJSON; resumable like /admin/users/export"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
     
-    return listings
+    query = {"status": status} if status else {}
+    listings = export_cursor(db.listings, query, None, after, limit)
+    return stream_ndjson(Listing, listings, limit)
 
 @api_router.post("/admin/listings/{listing_id}/status")
 async def update_listing_status(
@@ -801,26 +1311,65 @@ async def update_listing_status(
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    await db.listings.update_one(
+    before = await db.listings.find_one_and_update(
         {"id": listing_id},
-        {"$set": {"status": action.status}}
+        {"$set": {"status": action.status}},
+        projection=SHAPE_FIELDS,
+        return_document=ReturnDocument.BEFORE
     )
+    if before:
+        await counters.listing_changed(db, before=before, after={**before, "status": action.status})
+    listing_cache.clear()
     return {"message": f"Listing {action.status}"}
 
+@api_router.get("/admin/indexes")
+async def get_index_report(current_user: dict = Depends(get_current_user)):
+    """Declared indexes that are missing, plus existing indexes that are unused"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return await index_report(db)
+
+@api_router.get("/admin/metrics")
+async def get_metrics(current_user: dict = Depends(get_current_user)):
+    """In-process cache and queue counters for this worker"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "listing_cache": listing_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "view_counter": view_counter.stats(),
+        "counters": counters.stats(),
+        "listing_filters": listing_plans.stats(),
+        "media_queue": media_processor.stats(),
+        "realtime": hub.stats(),
+    }
+
 # ============ STATS ============
 
 @api_router.get("/locations")
-async def get_locations():
+async def get_locations(request: Request):
     """Get hierarchical location data"""
-    import json
-    locations_file = ROOT_DIR / "locations.json"
-    with open(locations_file, 'r') as f:
-        return json.load(f)
+    locations = await location_store.get()
+    headers = {"ETag": locations.etag, "Cache-Control": "public, max-age=300"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, locations.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(locations.body, headers=headers, media_type="application/json")
+
+@api_router.get("/locations/autocomplete")
+async def autocomplete_locations(q: str, limit: int = 10):
+    """Places whose name (or a word in it) starts with `q`, broadest first"""
+    locations = await location_store.get()
+    return locations.autocomplete(q, min(max(limit, 1), 50))
 
 @api_router.get("/stats")
 async def get_stats():
-    total_listings = await db.listings.count_documents({"status": "approved"})
-    total_users = await db.users.count_documents({})
+    total_listings = await counters.count_listings(db, "approved")
+    total_users = await counters.count_users(db)
     
     return {
         "total_listings": total_listings,
@@ -836,6 +1385,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -845,6 +1395,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes(db)
+    report = await index_report(db)
+    for collection, entry in report.items():
+        if entry["missing"]:
+            logger.warning(f"Missing indexes on {collection}: {entry['missing']}")
+
+@app.on_event("startup")
+async def startup_migrations():
+    # Runs online: requests are served while older documents are converted
+    async def run():
+        await migrate_dates(db)
+        await backfill_conversations(db)
+        await backfill_location_paths(db, await location_store.get())
+    app.state.migrations = asyncio.create_task(run())
+
+@app.on_event("startup")
+async def startup_background_workers():
+    await hub.start()
+    view_counter.start(db)
+    counters.start(db)
+    await media_processor.start(db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.migrations.cancel()
+    await hub.stop()
+    await view_counter.stop(db)
+    await counters.stop()
+    await media_processor.stop(db)
+    password_hasher.shutdown()
     client.close()
\ No newline at end of file
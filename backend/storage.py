@@ -0,0 +1,236 @@
+"""Storage backends for uploaded media.
+
+Objects are addressed by flat keys such as ``"{sha256}.jpg"``. Processing
+code works on local files, so every backend can hand out a local working copy
+of an object (``editing``) and store the results back when it's done.
+
+``LocalStorage`` keeps objects in a directory on the API host.
+``S3Storage`` keeps them in an S3-compatible bucket (AWS, MinIO, ...), which
+lets several API nodes share media without a shared disk.
+"""
+import asyncio
+import mimetypes
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Still being watermarked: the bytes will change, so always revalidate
+REVALIDATE = "no-cache"
+
+
+class Storage:
+    """Interface shared by the storage backends."""
+
+    #: Whether objects can be served straight from ``local_path``
+    is_local = False
+
+    async def put(self, key: str, source: Path, content_type: str = None, cache_control: str = None) -> None:
+        """Store the file at ``source`` under ``key``; ``source`` is consumed"""
+        raise NotImplementedError
+
+    async def copy(self, source_key: str, key: str, content_type: str = None, cache_control: str = None) -> None:
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def download(self, key: str, dest: Path) -> None:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Path:
+        raise NotImplementedError
+
+    async def url(self, key: str) -> str:
+        """Where clients can fetch ``key`` directly"""
+        raise NotImplementedError
+
+    async def presign_upload(self, key: str, content_type: str, expires: int = 900) -> dict:
+        """URL and headers a client can PUT ``key`` to without going through the API"""
+        raise NotImplementedError
+
+    def editing(self, key: str, outputs: tuple = (), source: str = None):
+        """Async context manager yielding a local path for ``key``.
+
+        The path starts out holding ``source`` when given, else ``key`` itself.
+        When the block exits cleanly, the file at that path and each key in
+        ``outputs`` written to the same directory are stored back as immutable.
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    is_local = True
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, key: str) -> Path:
+        return self.root / key
+
+    async def put(self, key: str, source: Path, content_type: str = None, cache_control: str = None) -> None:
+        self.local_path(key).parent.mkdir(parents=True, exist_ok=True)
+        # STORAGE_ROOT may be on another filesystem than the incoming directory
+        await asyncio.to_thread(shutil.move, source, self.local_path(key))
+
+    async def copy(self, source_key: str, key: str, content_type: str = None, cache_control: str = None) -> None:
+        path = self.local_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Copied next to the target and renamed over it, so readers never see a partial file
+        partial = path.with_name(f".{uuid.uuid4().hex}.{path.name}")
+        await asyncio.to_thread(shutil.copyfile, self.local_path(source_key), partial)
+        os.replace(partial, path)
+
+    async def exists(self, key: str) -> bool:
+        return self.local_path(key).is_file()
+
+    async def delete(self, key: str) -> None:
+        self.local_path(key).unlink(missing_ok=True)
+
+    async def download(self, key: str, dest: Path) -> None:
+        await asyncio.to_thread(shutil.copyfile, self.local_path(key), dest)
+
+    async def url(self, key: str) -> str:
+        raise NotImplementedError("Local objects are served by the API")
+
+    async def presign_upload(self, key: str, content_type: str, expires: int = 900) -> dict:
+        raise NotImplementedError("Direct uploads need S3 storage")
+
+    @asynccontextmanager
+    async def editing(self, key: str, outputs: tuple = (), source: str = None):
+        path = self.local_path(key)
+        if source is None:
+            # Processing writes in place; nothing to copy back
+            yield path
+            return
+        # A private working copy (dot names are never served), renamed over
+        # ``key`` once processing succeeds
+        work = path.with_name(f".{uuid.uuid4().hex}.{path.name}")
+        await asyncio.to_thread(shutil.copyfile, self.local_path(source), work)
+        try:
+            yield work
+            os.replace(work, path)
+        finally:
+            work.unlink(missing_ok=True)
+
+
+class S3Storage(Storage):
+    """S3-compatible bucket; blocking boto3 calls run in worker threads."""
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: str = None,
+        region: str = None,
+        public_url: str = None,
+        prefix: str = "",
+    ):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        # Objects are served from here when set (public bucket or CDN);
+        # otherwise clients get short-lived presigned GET URLs
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        # Large videos go up in 8MB parts, several at a time
+        self.transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def put(self, key: str, source: Path, content_type: str = None, cache_control: str = None) -> None:
+        extra_args = {}
+        if content_type:
+            extra_args["ContentType"] = content_type
+        if cache_control:
+            extra_args["CacheControl"] = cache_control
+        await asyncio.to_thread(
+            self.client.upload_file, str(source), self.bucket, self._key(key),
+            ExtraArgs=extra_args, Config=self.transfer_config,
+        )
+        Path(source).unlink(missing_ok=True)
+
+    async def copy(self, source_key: str, key: str, content_type: str = None, cache_control: str = None) -> None:
+        extra_args = {"MetadataDirective": "REPLACE"}
+        if content_type:
+            extra_args["ContentType"] = content_type
+        if cache_control:
+            extra_args["CacheControl"] = cache_control
+        # Server-side copy; multipart for objects over 5GB
+        await asyncio.to_thread(
+            self.client.copy, {"Bucket": self.bucket, "Key": self._key(source_key)}, self.bucket, self._key(key),
+            ExtraArgs=extra_args, Config=self.transfer_config,
+        )
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(key))
+
+    async def download(self, key: str, dest: Path) -> None:
+        await asyncio.to_thread(
+            self.client.download_file, self.bucket, self._key(key), str(dest), Config=self.transfer_config
+        )
+
+    async def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{self._key(key)}"
+        return await asyncio.to_thread(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=3600,
+        )
+
+    async def presign_upload(self, key: str, content_type: str, expires: int = 900) -> dict:
+        url = await asyncio.to_thread(
+            self.client.generate_presigned_url,
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key), "ContentType": content_type},
+            ExpiresIn=expires,
+        )
+        return {"url": url, "method": "PUT", "headers": {"Content-Type": content_type}}
+
+    @asynccontextmanager
+    async def editing(self, key: str, outputs: tuple = (), source: str = None):
+        with tempfile.TemporaryDirectory(prefix="media-") as workdir:
+            path = Path(workdir) / key
+            await self.download(source or key, path)
+            yield path
+            for name in (key, *outputs):
+                await self.put(name, Path(workdir) / name, content_type=content_type_for(name), cache_control=IMMUTABLE)
+
+
+def content_type_for(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def storage_from_env(default_root: Path) -> Storage:
+    backend = os.environ.get("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+            region=os.environ.get("S3_REGION"),
+            public_url=os.environ.get("S3_PUBLIC_URL"),
+            prefix=os.environ.get("S3_PREFIX", ""),
+        )
+    return LocalStorage(os.environ.get("STORAGE_ROOT", default_root))
@@ -0,0 +1,84 @@
+"""Buffered listing view counter.
+
+Detail-page views are accumulated in memory and written back periodically as
+a single unordered ``bulk_write``, so write load grows with the number of
+distinct listings viewed per interval rather than with the number of views.
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self._counts = Counter()
+        self._task = None
+        self.flushed_views = 0
+        self.flushes = 0
+
+    def record(self, listing_id: str, views: int = 1) -> None:
+        self._counts[listing_id] += views
+
+    def pending(self, listing_id: str) -> int:
+        """Views recorded for a listing that haven't reached the database yet"""
+        return self._counts.get(listing_id, 0)
+
+    async def flush(self, db) -> int:
+        """Write all buffered views; returns the number of listings updated"""
+        if not self._counts:
+            return 0
+        counts, self._counts = self._counts, Counter()
+        items = list(counts.items())
+        requests = [UpdateOne({"id": listing_id}, {"$inc": {"views": views}}) for listing_id, views in items]
+        failed = Counter()
+        try:
+            await db.listings.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # Unordered, so everything but the listed errors was applied;
+            # only those go back, or the rest would be counted twice
+            failed.update(dict(items[error["index"]] for error in e.details.get("writeErrors", [])))
+            logger.error(f"View counter flush failed for {len(failed)} of {len(requests)} listings: {e}")
+        except PyMongoError as e:
+            # Keep the views for the next attempt rather than dropping them
+            self._counts.update(counts)
+            logger.error(f"View counter flush failed: {e}")
+            return 0
+        self._counts.update(failed)
+        self.flushes += 1
+        self.flushed_views += sum(counts.values()) - sum(failed.values())
+        return len(requests) - len(failed)
+
+    async def _run(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush(db)
+
+    def start(self, db) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self, db) -> None:
+        """Stop the periodic flush and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(db)
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "pending_listings": len(self._counts),
+            "pending_views": sum(self._counts.values()),
+            "flushes": self.flushes,
+            "flushed_views": self.flushed_views,
+        }
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Link } from 'react-router-dom';
 import { X, MapPin, Eye, Heart, Mail, Phone, Sparkles, Clock, User, ExternalLink } from 'lucide-react';
 import { useAuth } from '../context/AuthContext';
@@ -18,13 +18,31 @@ const formatPrice = (amount) =>
     ? `${CURRENCY_SYMBOL}${amount}`
     : `${amount} ${CURRENCY_SYMBOL}`;
 
-const ListingModal = ({ listing, isOpen, onClose }) => {
+const ListingModal = ({ listing: summary, isOpen, onClose }) => {
   const { user } = useAuth();
   const [showAuthModal, setShowAuthModal] = useState(false);
   const [message, setMessage] = useState('');
   const [selectedMedia, setSelectedMedia] = useState(0);
+  const [details, setDetails] = useState(null);
 
-  if (!isOpen || !listing) return null;
+  // Grids pass slim cards; load the full listing (owner, description, media, pricing) on open
+  useEffect(() => {
+    if (!isOpen || !summary) return undefined;
+    let cancelled = false;
+    axios
+      .post(`${API}/listings/batch`, { ids: [summary.id] })
+      .then((response) => {
+        if (!cancelled && response.data.length > 0) setDetails(response.data[0]);
+      })
+      .catch((error) => console.error('Failed to fetch listing:', error));
+    return () => {
+      cancelled = true;
+    };
+  }, [isOpen, summary?.id]);
+
+  if (!isOpen || !summary) return null;
+
+  const listing = details?.id === summary.id ? details : summary;
 
   const images = listing.images?.length > 0 ? listing.images : ['https://images.unsplash.com/photo-1759771716328-db403c219f56?crop=entropy&cs=srgb&fm=jpg&q=85'];
   const videos = listing.videos || [];
@@ -57,6 +75,11 @@ const ListingModal = ({ listing, isOpen, onClose }) => {
       return;
     }
 
+    if (!listing.user_id) {
+      toast.error('Listing is still loading, please try again');
+      return;
+    }
+
     try {
       await axios.post(`${API}/messages`, {
         to_user_id: listing.user_id,
@@ -226,15 +249,17 @@ const ListingModal = ({ listing, isOpen, onClose }) => {
               </div>
 
               {/* View Full Profile Link */}
-              <Link
-                to={`/profile/${listing.user_id}`}
-                className="flex items-center justify-center space-x-2 w-full p-3 bg-white/5 rounded-lg hover:bg-white/10 transition-colors text-white"
-                data-testid="view-profile-link"
-                onClick={(e) => e.stopPropagation()}
-              >
-                <ExternalLink className="w-4 h-4" strokeWidth={1.5} />
-                <span>View Full Profile</span>
-              </Link>
+              {listing.user_id && (
+                <Link
+                  to={`/profile/${listing.user_id}`}
+                  className="flex items-center justify-center space-x-2 w-full p-3 bg-white/5 rounded-lg hover:bg-white/10 transition-colors text-white"
+                  data-testid="view-profile-link"
+                  onClick={(e) => e.stopPropagation()}
+                >
+                  <ExternalLink className="w-4 h-4" strokeWidth={1.5} />
+                  <span>View Full Profile</span>
+                </Link>
+              )}
 
               {/* Contact */}
               <div className="border-t border-white/10 pt-4">
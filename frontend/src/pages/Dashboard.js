@@ -27,8 +27,8 @@ const Dashboard = () => {
   const fetchData = async () => {
     try {
       const [listingsRes, favoritesRes] = await Promise.all([
-        axios.get(`${API}/listings/user/me`),
-        axios.get(`${API}/favorites`)
+        axios.get(`${API}/listings/user/me?view=card`),
+        axios.get(`${API}/favorites?view=card`)
       ]);
       setMyListings(listingsRes.data);
       setFavorites(favoritesRes.data);
@@ -92,7 +92,6 @@ const Home = () => {
   useEffect(() => {
     fetchListings();
     fetchStats();
-    fetchTotalCount();
   }, [category, gender, race, location, ageRange, currentPage, categoryType]);
 
   const fetchListings = async () => {
@@ -102,6 +101,7 @@ const Home = () => {
       params.append('status', 'approved');
       params.append('page', currentPage.toString());
       params.append('limit', ITEMS_PER_PAGE.toString());
+      params.append('view', 'card');
       
       if (category) params.append('category', category);
       if (gender) params.append('gender', gender);
@@ -116,8 +116,10 @@ const Home = () => {
         params.append('featured', 'true');
       }
 
-      const response = await axios.get(`${API}/listings?${params.toString()}`);
-      setListings(response.data);
+      // One request for the page and the total matching the same filters
+      const response = await axios.get(`${API}/listings/page?${params.toString()}`);
+      setListings(response.data.items);
+      setTotalListings(response.data.total);
     } catch (error) {
       console.error('Failed to fetch listings:', error);
     } finally {
@@ -125,23 +127,6 @@ const Home = () => {
     }
   };
 
-  const fetchTotalCount = async () => {
-    try {
-      const params = new URLSearchParams();
-      params.append('status', 'approved');
-      if (category) params.append('category', category);
-      if (gender) params.append('gender', gender);
-      if (race) params.append('race', race);
-      if (ageRange[0] > 18) params.append('min_age', ageRange[0].toString());
-      if (ageRange[1] < 60) params.append('max_age', ageRange[1].toString());
-
-      const response = await axios.get(`${API}/listings/count?${params.toString()}`);
-      setTotalListings(response.data.total);
-    } catch (error) {
-      console.error('Failed to fetch count:', error);
-    }
-  };
-
   const fetchStats = async () => {
     try {
       const response = await axios.get(`${API}/stats`);
@@ -154,7 +139,6 @@ const Home = () => {
   const handleSearch = () => {
     setCurrentPage(1);
     fetchListings();
-    fetchTotalCount();
   };
 
   const handleListingClick = (listing) => {
@@ -397,11 +381,23 @@ const Home = () => {
                 >
                   {/* Image */}
                   <div className="relative h-64 overflow-hidden">
-                    <img
-                      src={listing.images[0] || 'https://images.unsplash.com/photo-1759771716328-db403c219f56?crop=entropy&cs=srgb&fm=jpg&q=85'}
-                      alt={listing.title}
-                      className="listing-card-image w-full h-full object-cover"
-                    />
+                    <picture>
+                      {listing.image_variants?.[0]?.variants.length > 0 && (
+                        <source
+                          type="image/webp"
+                          srcSet={listing.image_variants[0].variants.map((v) => `${v.webp} ${v.width}w`).join(', ')}
+                          sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+                        />
+                      )}
+                      <img
+                        src={listing.images[0] || 'https://images.unsplash.com/photo-1759771716328-db403c219f56?crop=entropy&cs=srgb&fm=jpg&q=85'}
+                        srcSet={listing.image_variants?.[0]?.variants.map((v) => `${v.jpeg} ${v.width}w`).join(', ') || undefined}
+                        sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+                        alt={listing.title}
+                        loading="lazy"
+                        className="listing-card-image w-full h-full object-cover"
+                      />
+                    </picture>
                     {listing.featured && (
                       <div className="absolute top-3 right-3 bg-amber-500 text-black px-3 py-1 rounded-full text-xs font-bold flex items-center space-x-1 badge-verified">
                         <Sparkles className="w-3 h-3" />
@@ -9,31 +9,84 @@ import { Textarea } from '../components/ui/textarea';
 import AuthModal from '../components/AuthModal';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const WS_URL = `${API.replace(/^http/, 'ws')}/ws`;
 
 const Messages = () => {
-  const { user } = useAuth();
+  const { user, token } = useAuth();
   const navigate = useNavigate();
   const [showAuthModal, setShowAuthModal] = useState(false);
-  const [messages, setMessages] = useState([]);
+  const [conversations, setConversations] = useState([]);
+  const [threads, setThreads] = useState({});
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     if (user) {
-      fetchMessages();
+      fetchConversations();
     }
   }, [user]);
 
-  const fetchMessages = async () => {
+  // New messages are pushed over a WebSocket instead of polling
+  useEffect(() => {
+    if (!user || !token) return undefined;
+    let socket;
+    let retry;
+    let closed = false;
+
+    const connect = () => {
+      socket = new WebSocket(`${WS_URL}?token=${encodeURIComponent(token)}`);
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type !== 'message') return;
+        const msg = data.message;
+        const counterpart = msg.from_user_id === user.id ? msg.to_user_id : msg.from_user_id;
+        const id = `${msg.listing_id}:${counterpart}`;
+        setThreads((current) => (current[id] ? { ...current, [id]: [...current[id], msg] } : current));
+        fetchConversations();
+      };
+      socket.onclose = () => {
+        if (!closed) retry = setTimeout(connect, 3000);
+      };
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      socket.close();
+    };
+  }, [user, token]);
+
+  const fetchConversations = async () => {
     try {
-      const response = await axios.get(`${API}/messages`);
-      setMessages(response.data);
+      const response = await axios.get(`${API}/conversations`);
+      setConversations(response.data);
     } catch (error) {
-      console.error('Failed to fetch messages:', error);
+      console.error('Failed to fetch conversations:', error);
     } finally {
       setLoading(false);
     }
   };
 
+  const toggleThread = async (conversation) => {
+    if (threads[conversation.id]) {
+      const { [conversation.id]: _, ...rest } = threads;
+      setThreads(rest);
+      return;
+    }
+    try {
+      const response = await axios.get(
+        `${API}/messages/conversation/${conversation.listing_id}?with_user=${conversation.counterpart_id}`
+      );
+      setThreads({ ...threads, [conversation.id]: response.data });
+      if (conversation.unread > 0) {
+        await axios.post(`${API}/conversations/${conversation.listing_id}/${conversation.counterpart_id}/read`);
+        setConversations(conversations.map((c) => (c.id === conversation.id ? { ...c, unread: 0 } : c)));
+      }
+    } catch (error) {
+      console.error('Failed to fetch conversation:', error);
+    }
+  };
+
   if (!user) {
     return (
       <>
@@ -56,15 +109,6 @@ const Messages = () => {
     );
   }
 
-  // Group messages by listing
-  const groupedMessages = messages.reduce((acc, msg) => {
-    if (!acc[msg.listing_id]) {
-      acc[msg.listing_id] = [];
-    }
-    acc[msg.listing_id].push(msg);
-    return acc;
-  }, {});
-
   return (
     <div className="min-h-screen pt-20 pb-16">
       <div className="max-w-4xl mx-auto px-6 md:px-12 py-8">
@@ -76,7 +120,7 @@ const Messages = () => {
           <div className="text-center py-16">
             <div className="inline-block w-8 h-8 border-4 border-fuchsia-500 border-t-transparent rounded-full animate-spin"></div>
           </div>
-        ) : messages.length === 0 ? (
+        ) : conversations.length === 0 ? (
           <div className="glass rounded-2xl p-12 text-center">
             <p className="text-gray-400 mb-4">No messages yet.</p>
             <Button
@@ -88,32 +132,48 @@ const Messages = () => {
           </div>
         ) : (
           <div className="space-y-6" data-testid="messages-list">
-            {Object.entries(groupedMessages).map(([listingId, msgs]) => (
-              <div key={listingId} className="glass rounded-2xl p-6" data-testid={`message-group-${listingId}`}>
-                <h3 className="text-lg font-semibold mb-4" style={{ fontFamily: 'Playfair Display, serif' }}>
-                  Listing: {listingId}
-                </h3>
-                <div className="space-y-3">
-                  {msgs.map((msg) => (
-                    <div
-                      key={msg.id}
-                      className={`message-bubble p-4 rounded-lg ${
-                        msg.from_user_id === user.id
-                          ? 'bg-fuchsia-500/20 ml-8'
-                          : 'bg-white/5 mr-8'
-                      }`}
-                      data-testid={`message-${msg.id}`}
-                    >
-                      <p className="text-sm text-gray-400 mb-1">
-                        {msg.from_user_id === user.id ? 'You' : 'Them'}
-                      </p>
-                      <p className="text-white">{msg.content}</p>
-                      <p className="text-xs text-gray-500 mt-2">
-                        {new Date(msg.created_at).toLocaleString()}
-                      </p>
-                    </div>
-                  ))}
-                </div>
+            {conversations.map((conversation) => (
+              <div key={conversation.id} className="glass rounded-2xl p-6" data-testid={`message-group-${conversation.listing_id}`}>
+                <button
+                  type="button"
+                  onClick={() => toggleThread(conversation)}
+                  className="w-full text-left flex items-center justify-between gap-4"
+                >
+                  <div className="min-w-0">
+                    <h3 className="text-lg font-semibold mb-1" style={{ fontFamily: 'Playfair Display, serif' }}>
+                      Listing: {conversation.listing_id}
+                    </h3>
+                    <p className="text-sm text-gray-400 truncate">{conversation.last_message.content}</p>
+                  </div>
+                  {conversation.unread > 0 && (
+                    <span className="shrink-0 bg-fuchsia-500 text-white text-xs font-semibold px-2 py-1 rounded-full">
+                      {conversation.unread}
+                    </span>
+                  )}
+                </button>
+                {threads[conversation.id] && (
+                  <div className="space-y-3 mt-4">
+                    {threads[conversation.id].map((msg) => (
+                      <div
+                        key={msg.id}
+                        className={`message-bubble p-4 rounded-lg ${
+                          msg.from_user_id === user.id
+                            ? 'bg-fuchsia-500/20 ml-8'
+                            : 'bg-white/5 mr-8'
+                        }`}
+                        data-testid={`message-${msg.id}`}
+                      >
+                        <p className="text-sm text-gray-400 mb-1">
+                          {msg.from_user_id === user.id ? 'You' : 'Them'}
+                        </p>
+                        <p className="text-white">{msg.content}</p>
+                        <p className="text-xs text-gray-500 mt-2">
+                          {new Date(msg.created_at).toLocaleString()}
+                        </p>
+                      </div>
+                    ))}
+                  </div>
+                )}
               </div>
             ))}
           </div>
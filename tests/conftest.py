@@ -0,0 +1,9 @@
+"""Shared setup for the unit tests: backend modules import as top-level modules,
+and server.py gets Mongo settings (the client connects lazily, so no server is needed)."""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
@@ -0,0 +1,118 @@
+"""
+Unit tests for the in-process TTLCache
+"""
+import asyncio
+
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def patch_clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr("cache.time.monotonic", clock)
+    return clock
+
+
+class TestExpiry:
+    """Entries expire ttl seconds after being stored"""
+
+    def test_expires_after_ttl(self, monkeypatch):
+        clock = patch_clock(monkeypatch)
+        cache = TTLCache(ttl=30)
+        cache.set("k", "v")
+        clock.now += 29.9
+        assert cache.get("k") == "v"
+        clock.now += 0.1
+        assert cache.get("k") is None
+        assert len(cache) == 0
+
+    def test_per_entry_ttl(self, monkeypatch):
+        clock = patch_clock(monkeypatch)
+        cache = TTLCache(ttl=30)
+        cache.set("short", 1, ttl=5)
+        cache.set("long", 2)
+        clock.now += 10
+        assert cache.get("short") is None
+        assert cache.get("long") == 2
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.evictions == 1
+
+
+class TestGetOrLoad:
+    """Single-flight loading and generation-based invalidation"""
+
+    def test_concurrent_misses_share_one_load(self):
+        cache = TTLCache()
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "value"
+
+        async def main():
+            return await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(10)))
+
+        assert asyncio.run(main()) == ["value"] * 10
+        assert calls == 1
+        assert cache.get("k") == "value"
+
+    def test_cached_value_skips_loader(self):
+        cache = TTLCache()
+        cache.set("k", "cached")
+
+        async def loader():
+            raise AssertionError("loader should not run")
+
+        assert asyncio.run(cache.get_or_load("k", loader)) == "cached"
+
+    def test_clear_during_load_discards_result(self):
+        cache = TTLCache()
+
+        async def main():
+            started = asyncio.Event()
+
+            async def loader():
+                started.set()
+                await asyncio.sleep(0.01)
+                return "stale"
+
+            load = asyncio.ensure_future(cache.get_or_load("k", loader))
+            await started.wait()
+            cache.clear()
+            return await load
+
+        # The caller still gets its value, but it isn't cached past the invalidation
+        assert asyncio.run(main()) == "stale"
+        assert cache.get("k") is None
+
+    def test_failed_load_not_cached(self):
+        cache = TTLCache()
+
+        async def loader():
+            raise RuntimeError("boom")
+
+        async def main():
+            try:
+                await cache.get_or_load("k", loader)
+            except RuntimeError:
+                pass
+            return await cache.get_or_load("k", lambda: asyncio.sleep(0, result="ok"))
+
+        assert asyncio.run(main()) == "ok"
@@ -0,0 +1,154 @@
+"""
+Unit tests for ListingCounters.reconcile against an in-memory stand-in for the collections
+"""
+import asyncio
+from types import SimpleNamespace
+
+from counters import USERS_ID, ListingCounters, counter_id
+
+
+def matches(document: dict, query: dict) -> bool:
+    for field, value in query.items():
+        if isinstance(value, dict) and "$in" in value:
+            if document.get(field) not in value["$in"]:
+                return False
+        elif document.get(field) != value:
+            return False
+    return True
+
+
+class FakeCounters:
+    """The few counters collection operations reconcile and the write paths use.
+
+    Every call yields to the event loop first, so concurrent reconciles interleave.
+    """
+
+    def __init__(self, rows: dict):
+        self.rows = {_id: {"_id": _id, "count": count} for _id, count in rows.items()}
+
+    async def find(self, query, projection):
+        await asyncio.sleep(0)
+        for row in list(self.rows.values()):
+            yield dict(row)
+
+    def inc(self, _id: str, delta: int) -> None:
+        self.rows.setdefault(_id, {"_id": _id, "count": 0})["count"] += delta
+
+    async def bulk_write(self, requests, ordered=True):
+        await asyncio.sleep(0)
+        modified = upserted = 0
+        for request in requests:
+            query, update = request._filter, request._doc
+            row = self.rows.get(query["_id"])
+            if row is None:
+                if request._upsert:
+                    self.rows[query["_id"]] = {"_id": query["_id"], **update.get("$setOnInsert", {})}
+                    upserted += 1
+            elif matches(row, query) and "$set" in update:
+                row.update(update["$set"])
+                modified += 1
+        return SimpleNamespace(modified_count=modified, upserted_count=upserted)
+
+    async def delete_many(self, query):
+        await asyncio.sleep(0)
+        for _id in [_id for _id, row in self.rows.items() if matches(row, query)]:
+            del self.rows[_id]
+
+
+class FakeListings:
+    def __init__(self, groups: list, before_group=None):
+        self.groups = groups
+        self.before_group = before_group
+
+    async def aggregate(self, pipeline):
+        await asyncio.sleep(0)
+        if self.before_group:
+            self.before_group()
+        for shape, count in self.groups:
+            yield {"_id": shape, "count": count}
+
+
+class FakeUsers:
+    def __init__(self, count: int):
+        self.count = count
+
+    async def count_documents(self, query):
+        await asyncio.sleep(0)
+        return self.count
+
+
+APPROVED = {"status": "approved", "category": "female", "gender": "Female"}
+APPROVED_ID = counter_id(("approved", "female", "Female"))
+
+
+def make_db(stored: dict, groups: list, users: int = 0, before_group=None):
+    return SimpleNamespace(
+        counters=FakeCounters(stored), listings=FakeListings(groups, before_group), users=FakeUsers(users)
+    )
+
+
+def counts(db) -> dict:
+    return {_id: row["count"] for _id, row in db.counters.rows.items()}
+
+
+class TestReconcile:
+    """Counters are set to the counted values"""
+
+    def test_first_run_creates_counters(self):
+        db = make_db({}, [(APPROVED, 3)], users=2)
+        assert asyncio.run(ListingCounters().reconcile(db)) == 2
+        assert counts(db) == {APPROVED_ID: 3, USERS_ID: 2}
+        assert db.counters.rows[APPROVED_ID]["kind"] == "listings"
+        assert db.counters.rows[APPROVED_ID]["category"] == "female"
+
+    def test_corrects_drift(self):
+        db = make_db({APPROVED_ID: 5, USERS_ID: 2}, [(APPROVED, 3)], users=2)
+        assert asyncio.run(ListingCounters().reconcile(db)) == 1
+        assert counts(db) == {APPROVED_ID: 3, USERS_ID: 2}
+
+    def test_correct_counters_untouched(self):
+        db = make_db({APPROVED_ID: 3, USERS_ID: 2}, [(APPROVED, 3)], users=2)
+        assert asyncio.run(ListingCounters().reconcile(db)) == 0
+
+    def test_null_and_missing_fields_summed(self):
+        shape_id = counter_id(("approved", "female", None))
+        groups = [({"status": "approved", "category": "female", "gender": None}, 2),
+                  ({"status": "approved", "category": "female"}, 3)]
+        db = make_db({}, groups)
+        asyncio.run(ListingCounters().reconcile(db))
+        assert counts(db)[shape_id] == 5
+
+    def test_stale_shapes_removed(self):
+        stale = counter_id(("pending", "female", "Female"))
+        db = make_db({stale: 4, APPROVED_ID: 3, USERS_ID: 0}, [(APPROVED, 3)])
+        asyncio.run(ListingCounters().reconcile(db))
+        assert counts(db) == {APPROVED_ID: 3, USERS_ID: 0}
+
+
+class TestReconcileRaces:
+    """Counters that move while reconcile runs are not corrected twice"""
+
+    def test_concurrent_reconciles_from_empty(self):
+        db = make_db({}, [(APPROVED, 3)], users=2)
+
+        async def both():
+            return await asyncio.gather(ListingCounters().reconcile(db), ListingCounters().reconcile(db))
+
+        asyncio.run(both())
+        assert counts(db) == {APPROVED_ID: 3, USERS_ID: 2}
+
+    def test_concurrent_reconciles_with_drift(self):
+        db = make_db({APPROVED_ID: 5, USERS_ID: 1}, [(APPROVED, 3)], users=2)
+
+        async def both():
+            return await asyncio.gather(ListingCounters().reconcile(db), ListingCounters().reconcile(db))
+
+        assert sorted(asyncio.run(both())) == [0, 2]
+        assert counts(db) == {APPROVED_ID: 3, USERS_ID: 2}
+
+    def test_write_between_snapshot_and_count(self):
+        # A listing inserted after the snapshot: counted by the $group and by its own $inc
+        db = make_db({APPROVED_ID: 3, USERS_ID: 0}, [(APPROVED, 4)],
+                     before_group=lambda: db.counters.inc(APPROVED_ID, 1))
+        assert asyncio.run(ListingCounters().reconcile(db)) == 0
+        assert counts(db)[APPROVED_ID] == 4
@@ -0,0 +1,43 @@
+"""
+Unit tests for the opaque keyset cursors used by listing, inbox and thread pagination
+"""
+import base64
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from server import decode_cursor, encode_cursor, seek_after
+
+
+class TestCursors:
+    """encode_cursor / decode_cursor round trip and validation"""
+
+    def test_round_trip(self):
+        created_at = datetime(2025, 3, 1, 12, 30, 15, 123000, tzinfo=timezone.utc)
+        assert decode_cursor(encode_cursor(created_at, "abc-123")) == (created_at, "abc-123")
+
+    def test_url_safe_without_padding(self):
+        cursor = encode_cursor(datetime(2025, 1, 1, tzinfo=timezone.utc), "x" * 7)
+        assert "=" not in cursor
+        assert all(c.isalnum() or c in "-_" for c in cursor)
+
+    @pytest.mark.parametrize("cursor", [
+        "not a cursor!",
+        base64.urlsafe_b64encode(b"{}").decode(),
+        base64.urlsafe_b64encode(b'["2025-01-01"]').decode(),
+        base64.urlsafe_b64encode(b'["yesterday", "id"]').decode(),
+        base64.urlsafe_b64encode(b'[1, "id"]').decode(),
+    ])
+    def test_invalid_cursor_is_400(self, cursor):
+        with pytest.raises(HTTPException) as exc:
+            decode_cursor(cursor)
+        assert exc.value.status_code == 400
+
+    def test_seek_after(self):
+        created_at = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        clause = seek_after(encode_cursor(created_at, "m5"), "last_message_at")
+        assert clause == {"$or": [
+            {"last_message_at": {"$lt": created_at}},
+            {"last_message_at": created_at, "id": {"$lt": "m5"}},
+        ]}
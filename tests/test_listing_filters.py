@@ -0,0 +1,116 @@
+"""
+Unit tests for listing_filters: filter normalization and query/sort/hint compilation
+"""
+import bson
+from pymongo import ASCENDING, DESCENDING
+
+from listing_filters import NEWEST_FIRST, ListingFilter, compile_filter
+from locations import LocationSnapshot
+
+LOCATIONS = LocationSnapshot({"Ethiopia": {"Addis Ababa": {"Bole": ["Gelan"]}}})
+
+
+class TestListingFilterParams:
+    """ListingFilter.from_params normalization"""
+
+    def test_blank_values_dropped(self):
+        spec = ListingFilter.from_params(status="approved", category="", race="   ", location=None)
+        assert spec == ListingFilter()
+        assert spec.set_fields() == ()
+
+    def test_whitespace_collapsed(self):
+        spec = ListingFilter.from_params(category="  female ", location="Addis   Ababa")
+        assert spec.category == "female"
+        assert spec.location == "Addis Ababa"
+
+    def test_search_casefolded(self):
+        assert ListingFilter.from_params(search="  Bole  SPA ").search == "bole spa"
+
+    def test_missing_status_defaults(self):
+        assert ListingFilter.from_params(status=None).status == "approved"
+        assert ListingFilter.from_params(status="pending").status == "pending"
+
+    def test_equivalent_params_equal_and_hash_alike(self):
+        a = ListingFilter.from_params(category=" female", race="")
+        b = ListingFilter.from_params(category="female")
+        assert a == b
+        assert hash(a) == hash(b)
+        assert len({a, b}) == 1
+
+    def test_falsy_values_kept(self):
+        spec = ListingFilter.from_params(featured=False, min_price=0)
+        assert spec.featured is False
+        assert spec.min_price == 0
+        assert spec.set_fields() == ("min_price", "featured")
+
+    def test_counter_only(self):
+        assert ListingFilter().counter_only()
+        assert ListingFilter(category="female", gender="Female").counter_only()
+        assert not ListingFilter(category="female", race="x").counter_only()
+        assert not ListingFilter(featured=False).counter_only()
+
+
+class TestCompileFilter:
+    """compile_filter query, sort and hint per filter shape"""
+
+    def test_status_only(self):
+        compiled = compile_filter(ListingFilter(), LOCATIONS)
+        assert compiled.query == {"status": "approved"}
+        assert compiled.sort == NEWEST_FIRST
+        assert compiled.hint == [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]
+        assert compiled.shape == ("status",)
+
+    def test_category_and_gender_hint(self):
+        compiled = compile_filter(ListingFilter(category="female", gender="Female"), LOCATIONS)
+        assert compiled.query == {"status": "approved", "category": "female", "gender": "Female"}
+        assert compiled.hint[:3] == [("status", ASCENDING), ("category", ASCENDING), ("gender", ASCENDING)]
+        assert compiled.shape == ("status", "category", "gender")
+
+    def test_featured_hint_only_without_category(self):
+        featured = compile_filter(ListingFilter(featured=True), LOCATIONS)
+        assert featured.hint[:2] == [("status", ASCENDING), ("featured", ASCENDING)]
+        with_category = compile_filter(ListingFilter(featured=True, category="female"), LOCATIONS)
+        assert with_category.hint[:2] == [("status", ASCENDING), ("category", ASCENDING)]
+
+    def test_command_options_hint_is_index_document(self):
+        # aggregate() passes kwargs through untouched; a list would reach the server as a BSON array
+        options = compile_filter(ListingFilter(category="female"), LOCATIONS).command_options()
+        assert isinstance(options["hint"], dict)
+        assert list(options["hint"].items()) == [
+            ("status", ASCENDING), ("category", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)
+        ]
+        assert isinstance(bson.decode(bson.encode(options))["hint"], dict)
+
+    def test_command_options_without_hint(self):
+        assert compile_filter(ListingFilter(search="bole"), LOCATIONS).command_options() == {}
+
+    def test_gender_alone_left_to_planner(self):
+        assert compile_filter(ListingFilter(gender="Female"), LOCATIONS).hint is None
+
+    def test_ranges(self):
+        compiled = compile_filter(ListingFilter(min_age=20, max_age=30, min_price=0, max_price=100), LOCATIONS)
+        assert compiled.query["age"] == {"$gte": 20, "$lte": 30}
+        assert compiled.query["price"] == {"$gte": 0, "$lte": 100}
+
+    def test_search(self):
+        compiled = compile_filter(ListingFilter(search="bole"), LOCATIONS)
+        assert compiled.query["$text"] == {"$search": "bole"}
+        assert compiled.sort == (("score", {"$meta": "textScore"}),) + NEWEST_FIRST
+        assert compiled.hint is None
+
+    def test_known_location_uses_path_prefix(self):
+        compiled = compile_filter(ListingFilter(location="Bole"), LOCATIONS)
+        branches = compiled.query["$or"]
+        assert branches[0] == {"location_path": {"$regex": "^ethiopia/addis\\-ababa/bole(/|$)"}}
+        assert branches[-1]["location_path"] is None
+        assert compiled.hint is None
+        assert compiled.shape == ("status", "location")
+
+    def test_unknown_location_falls_back_to_text(self):
+        compiled = compile_filter(ListingFilter(location="Nowhere"), LOCATIONS)
+        assert all("location_path" not in branch for branch in compiled.query["$or"])
+        assert compiled.shape == ("status", "location_text")
+
+    def test_memoized(self):
+        spec = ListingFilter(category="female", race="x")
+        assert compile_filter(spec, LOCATIONS) is compile_filter(ListingFilter.from_params(category="female ", race="x"), LOCATIONS)
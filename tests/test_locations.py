@@ -0,0 +1,109 @@
+"""
+Unit tests for the location hierarchy snapshot
+"""
+from locations import LocationSnapshot
+
+DATA = {
+    "Ethiopia": {
+        "Addis Ababa": {
+            "Akaki Kality": ["Akaki", "Bole"],
+            "Bole": ["Bole Airport", "Gelan"],
+        },
+        "Oromia": {
+            "Adama": ["Kebele 01", "Kebele 02"],
+            "Bishoftu": ["Kebele 01"],
+        },
+    }
+}
+
+SNAPSHOT = LocationSnapshot(DATA)
+
+
+def labels(entries):
+    return [entry["label"] for entry in entries]
+
+
+class TestAutocomplete:
+    """Prefix search over the word index"""
+
+    def test_prefix_of_first_word(self):
+        assert labels(SNAPSHOT.autocomplete("ada")) == ["Adama, Oromia, Ethiopia"]
+
+    def test_prefix_of_later_word(self):
+        assert labels(SNAPSHOT.autocomplete("airp")) == ["Bole Airport, Bole, Addis Ababa, Ethiopia"]
+
+    def test_broadest_first_then_by_label(self):
+        assert labels(SNAPSHOT.autocomplete("bole")) == [
+            "Bole, Addis Ababa, Ethiopia",
+            "Bole Airport, Bole, Addis Ababa, Ethiopia",
+            "Bole, Akaki Kality, Addis Ababa, Ethiopia",
+        ]
+
+    def test_case_and_accent_insensitive(self):
+        assert labels(SNAPSHOT.autocomplete("  ÁDAMA ")) == ["Adama, Oromia, Ethiopia"]
+
+    def test_limit(self):
+        assert len(SNAPSHOT.autocomplete("kebele", limit=2)) == 2
+        assert len(SNAPSHOT.autocomplete("kebele")) == 3
+
+    def test_no_match_or_blank(self):
+        assert SNAPSHOT.autocomplete("zz") == []
+        assert SNAPSHOT.autocomplete("   ") == []
+
+    def test_entry_shape(self):
+        entry = SNAPSHOT.autocomplete("gelan")[0]
+        assert entry == {
+            "name": "Gelan",
+            "level": "district",
+            "path": ["Ethiopia", "Addis Ababa", "Bole", "Gelan"],
+            "label": "Gelan, Bole, Addis Ababa, Ethiopia",
+        }
+
+
+class TestResolve:
+    """Canonical names and paths for listing locations"""
+
+    def test_dict_matches_each_level_case_insensitively(self):
+        canonical, path = SNAPSHOT.resolve({"country": "ethiopia", "region": "ADDIS ababa", "city": "bole"})
+        assert canonical == {"country": "Ethiopia", "region": "Addis Ababa", "city": "Bole"}
+        assert path == "ethiopia/addis-ababa/bole"
+
+    def test_dict_stops_at_first_unknown_level(self):
+        location = {"country": "Ethiopia", "region": "Oromia", "city": "Nowhere", "district": "Kebele 01"}
+        canonical, path = SNAPSHOT.resolve(location)
+        assert canonical == location
+        assert path == "ethiopia/oromia"
+
+    def test_dict_unknown_country(self):
+        location = {"country": "Kenya", "city": "Nairobi"}
+        assert SNAPSHOT.resolve(location) == (location, None)
+
+    def test_free_text(self):
+        assert SNAPSHOT.resolve("Adama, Oromia") == ("Adama, Oromia", "ethiopia/oromia/adama")
+
+    def test_free_text_broadest_wins(self):
+        assert SNAPSHOT.resolve("Bole")[1] == "ethiopia/addis-ababa/bole"
+
+    def test_free_text_narrowed_by_other_parts(self):
+        assert SNAPSHOT.resolve("Bole, Akaki Kality")[1] == "ethiopia/addis-ababa/akaki-kality/bole"
+
+    def test_free_text_unknown_or_blank(self):
+        assert SNAPSHOT.resolve("Bole, Oromia") == ("Bole, Oromia", None)
+        assert SNAPSHOT.resolve("  ") == ("  ", None)
+
+
+class TestPathPrefixes:
+    """Location filter text to location_path prefixes"""
+
+    def test_name_at_several_levels(self):
+        assert sorted(SNAPSHOT.path_prefixes("bole")) == [
+            "ethiopia/addis-ababa/akaki-kality/bole",
+            "ethiopia/addis-ababa/bole",
+        ]
+
+    def test_path_is_slugified(self):
+        assert SNAPSHOT.path_prefixes("Ethiopia/Addis Ababa/") == ["ethiopia/addis-ababa"]
+        assert SNAPSHOT.path_prefixes("ethiopia/addis-ababa") == ["ethiopia/addis-ababa"]
+
+    def test_unknown(self):
+        assert SNAPSHOT.path_prefixes("Nairobi") == []
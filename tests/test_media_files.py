@@ -0,0 +1,53 @@
+"""
+Unit tests for Range and If-None-Match handling when serving uploads
+"""
+import pytest
+
+from media_files import etag_matches, parse_range
+
+
+class TestParseRange:
+    """parse_range against a 1000-byte file"""
+
+    @pytest.mark.parametrize("header,expected", [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=500-", (500, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("bytes=900-5000", (900, 999)),
+        (" bytes=10-10 ", (10, 10)),
+    ])
+    def test_satisfiable(self, header, expected):
+        assert parse_range(header, 1000) == expected
+
+    @pytest.mark.parametrize("header", [
+        "bytes=5-2",          # last before first: invalid, so ignored
+        "bytes=0-1,5-9",      # multiple ranges
+        "bytes=-",
+        "items=0-9",
+        "garbage",
+    ])
+    def test_ignored(self, header):
+        assert parse_range(header, 1000) is None
+
+    @pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=-0"])
+    def test_unsatisfiable(self, header):
+        with pytest.raises(ValueError):
+            parse_range(header, 1000)
+
+
+class TestEtagMatches:
+    """If-None-Match comparison"""
+
+    def test_exact(self):
+        assert etag_matches('"abc"', '"abc"')
+
+    def test_list_and_weak(self):
+        assert etag_matches('"x", W/"abc" , "y"', '"abc"')
+
+    def test_wildcard(self):
+        assert etag_matches(" * ", '"abc"')
+
+    def test_mismatch(self):
+        assert not etag_matches('"abcd"', '"abc"')
+        assert not etag_matches('abc', '"abc"')
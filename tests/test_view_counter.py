@@ -0,0 +1,71 @@
+"""
+Unit tests for the buffered ViewCounter flush
+"""
+import asyncio
+from types import SimpleNamespace
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from view_counter import ViewCounter
+
+
+class FakeListings:
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.requests.append(requests)
+        if self.error:
+            raise self.error
+
+
+def make_counter(**views) -> ViewCounter:
+    counter = ViewCounter()
+    for listing_id, n in views.items():
+        counter.record(listing_id, n)
+    return counter
+
+
+class TestFlush:
+    """Buffered views are written once, and kept when the write fails"""
+
+    def test_flush_writes_and_empties(self):
+        counter = make_counter(a=3, b=1)
+        db = SimpleNamespace(listings=FakeListings())
+        assert asyncio.run(counter.flush(db)) == 2
+        assert [r._doc for r in db.listings.requests[0]] == [{"$inc": {"views": 3}}, {"$inc": {"views": 1}}]
+        assert counter.pending("a") == 0
+        assert counter.stats()["flushed_views"] == 4
+
+    def test_nothing_buffered(self):
+        db = SimpleNamespace(listings=FakeListings())
+        assert asyncio.run(ViewCounter().flush(db)) == 0
+        assert db.listings.requests == []
+
+    def test_failed_flush_keeps_views(self):
+        counter = make_counter(a=3, b=1)
+        db = SimpleNamespace(listings=FakeListings(AutoReconnect("down")))
+        assert asyncio.run(counter.flush(db)) == 0
+        assert counter.pending("a") == 3
+        assert counter.pending("b") == 1
+
+    def test_partial_failure_keeps_only_failed_views(self):
+        counter = make_counter(a=3, b=1, c=2)
+        error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "boom"}]})
+        db = SimpleNamespace(listings=FakeListings(error))
+        assert asyncio.run(counter.flush(db)) == 2
+        assert (counter.pending("a"), counter.pending("b"), counter.pending("c")) == (0, 1, 0)
+        assert counter.stats()["flushed_views"] == 5
+
+    def test_views_recorded_during_flush_kept(self):
+        counter = make_counter(a=1)
+        error = BulkWriteError({"writeErrors": [{"index": 0, "code": 1, "errmsg": "boom"}]})
+
+        class Recording(FakeListings):
+            async def bulk_write(self, requests, ordered=True):
+                counter.record("a", 2)
+                await super().bulk_write(requests, ordered)
+
+        asyncio.run(counter.flush(SimpleNamespace(listings=Recording(error))))
+        assert counter.pending("a") == 3